@@ -1,26 +1,162 @@
-import os, threading, datetime, io
-from flask import Flask, render_template_string, redirect, url_for, request, jsonify, send_file
-from sqlalchemy import create_engine, Column, Integer, String, Boolean, DateTime
+import os, sys, threading, datetime, io, json, time, collections, gzip, hashlib, csv, tempfile, contextlib, cProfile, base64, re, unicodedata, math
+STARTUP_T0 = time.perf_counter()     # arranque del worker, incluye importar dependencias
+import click
+from concurrent.futures import ThreadPoolExecutor
+from flask import Flask, render_template, redirect, url_for, request, jsonify, send_file, Response, g, has_request_context, abort
+from sqlalchemy import create_engine, event, Column, Integer, String, Boolean, DateTime, Float, Index, inspect, text, select, update, delete, insert, func, or_, bindparam
+from sqlalchemy.dialects import postgresql, sqlite as sqlite_dialect
 from sqlalchemy.orm import sessionmaker, declarative_base
 from sqlalchemy.exc import OperationalError
 from openpyxl import Workbook
+from prometheus_client import Counter, Gauge, Histogram, CollectorRegistry, REGISTRY, generate_latest, multiprocess, CONTENT_TYPE_LATEST
+from prometheus_client.core import GaugeMetricFamily
+
+try:
+    import brotli
+except ImportError:  # sin brotli se comprime solo con gzip
+    brotli = None
 
 # --- Config base de datos (Postgres si DATABASE_URL, si no SQLite) ---
 DB_DEFAULT = "sqlite:////var/data/state.db"
-DATABASE_URL = os.environ.get("DATABASE_URL", DB_DEFAULT)
 
-# Normalizar para psycopg 3 (evitar que SQLAlchemy use psycopg2)
-if DATABASE_URL.startswith("postgres://"):
-    DATABASE_URL = DATABASE_URL.replace("postgres://", "postgresql+psycopg://", 1)
-elif DATABASE_URL.startswith("postgresql://") and "+psycopg" not in DATABASE_URL:
-    DATABASE_URL = DATABASE_URL.replace("postgresql://", "postgresql+psycopg://", 1)
+def normalize_db_url(url):
+    # Normalizar para psycopg 3 (evitar que SQLAlchemy use psycopg2)
+    if url.startswith("postgres://"):
+        return url.replace("postgres://", "postgresql+psycopg://", 1)
+    if url.startswith("postgresql://") and "+psycopg" not in url:
+        return url.replace("postgresql://", "postgresql+psycopg://", 1)
+    return url
+
+DATABASE_URL = normalize_db_url(os.environ.get("DATABASE_URL", DB_DEFAULT))
+# Réplica de lectura opcional (ver "Réplica de lectura" más abajo)
+DATABASE_READ_URL = normalize_db_url(os.environ.get("DATABASE_READ_URL", ""))
 
 print("DB URL in use:", DATABASE_URL.split("@")[0])  # debug opcional
+if DATABASE_READ_URL:
+    print("DB read URL in use:", DATABASE_READ_URL.split("@")[0])
+
+# Pool configurable por entorno. SQLite abre conexiones locales baratas (sin
+# pre_ping ni recycle); Postgres recicla para no chocar con timeouts del server.
+IS_SQLITE = DATABASE_URL.startswith("sqlite")
+SQLITE_BUSY_TIMEOUT_MS = int(os.environ.get("SQLITE_BUSY_TIMEOUT_MS", "5000"))
+
+def running_under_gevent():
+    monkey = sys.modules.get("gevent.monkey")
+    return monkey is not None and monkey.is_module_patched("socket")
+
+# sqlite3 no le cede el control a gevent: mientras espera el lock congela todo
+# el worker. Con gevent se espera poco y el pick falla con ERROR_DB en vez de
+# trabar a todos (gunicorn.conf.py usa gthread con SQLite por esto).
+if running_under_gevent():
+    SQLITE_BUSY_TIMEOUT_MS = min(SQLITE_BUSY_TIMEOUT_MS, int(os.environ.get("SQLITE_GEVENT_BUSY_TIMEOUT_MS", "250")))
+
+def make_engine(url):
+    is_sqlite = url.startswith("sqlite")
+    eng = create_engine(
+        url,
+        pool_size=int(os.environ.get("DB_POOL_SIZE", "5")),
+        max_overflow=int(os.environ.get("DB_MAX_OVERFLOW", "10")),
+        pool_timeout=float(os.environ.get("DB_POOL_TIMEOUT", "30")),
+        pool_recycle=int(os.environ.get("DB_POOL_RECYCLE", "-1" if is_sqlite else "1800")),
+        pool_pre_ping=not is_sqlite,
+        connect_args={"timeout": SQLITE_BUSY_TIMEOUT_MS / 1000} if is_sqlite else {},
+    )
+    if not is_sqlite:
+        return eng
+
+    # Perfil de producción para SQLite: WAL (los lectores no bloquean al que
+    # escribe), synchronous=NORMAL (fsync por checkpoint, no por commit) y
+    # busy_timeout. Las transacciones de escritura (WriteSession) arrancan con
+    # BEGIN IMMEDIATE: toman el lock de escritura de entrada y esperan
+    # busy_timeout, en vez de fallar con "database is locked" al querer pasar de
+    # lector a escritor a mitad de la transacción.
+    @event.listens_for(eng, "connect")
+    def _sqlite_connect(dbapi_conn, record):
+        dbapi_conn.isolation_level = None       # el BEGIN lo manda _sqlite_begin
+        cur = dbapi_conn.cursor()
+        if eng.url.database not in (None, "", ":memory:"):
+            cur.execute("PRAGMA journal_mode=WAL")
+        cur.execute("PRAGMA synchronous=NORMAL")
+        cur.execute(f"PRAGMA busy_timeout={SQLITE_BUSY_TIMEOUT_MS}")
+        cur.close()
+
+    @event.listens_for(eng, "begin")
+    def _sqlite_begin(conn):
+        conn.exec_driver_sql("BEGIN IMMEDIATE" if conn.get_execution_options().get("sqlite_immediate") else "BEGIN")
+
+    return eng
+
+engine = make_engine(DATABASE_URL)
+read_engine = make_engine(DATABASE_READ_URL) if DATABASE_READ_URL else engine
 
-engine = create_engine(DATABASE_URL, pool_pre_ping=True)
 Session = sessionmaker(bind=engine)
+WriteSession = sessionmaker(bind=engine.execution_options(sqlite_immediate=True))
+ReadSession = sessionmaker(bind=read_engine)
 Base = declarative_base()
-lock = threading.Lock()
+
+# --- Métricas (formato Prometheus, ver /metrics) ---
+# Con gunicorn, gunicorn.conf.py define PROMETHEUS_MULTIPROC_DIR: cada worker
+# escribe ahí sus valores y /metrics suma los de todos los workers.
+LATENCY_BUCKETS = (.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10)
+REQUEST_LATENCY = Histogram("rifa_request_duration_seconds", "Duración de cada pedido", ["route", "method"], buckets=LATENCY_BUCKETS)
+REQUESTS = Counter("rifa_requests_total", "Pedidos atendidos", ["route", "status"])
+REQUEST_DB_TIME = Histogram("rifa_request_db_seconds", "Tiempo en la base por pedido", ["route"], buckets=LATENCY_BUCKETS)
+DB_QUERIES = Counter("rifa_db_queries_total", "Consultas SQL ejecutadas", ["route"])
+WRITE_LOCK_WAIT = Histogram("rifa_write_lock_wait_seconds", "Espera hasta obtener el lock de escritura de la base", ["op"], buckets=LATENCY_BUCKETS)
+WRITE_LOCK_HOLD = Histogram("rifa_write_lock_hold_seconds", "Tiempo con el lock de escritura tomado, hasta el commit", ["op"], buckets=LATENCY_BUCKETS)
+POOL_CHECKOUTS = Counter("rifa_db_pool_checkouts_total", "Conexiones tomadas del pool")
+POOL_CONNECTS = Counter("rifa_db_pool_connects_total", "Conexiones nuevas abiertas por el pool")
+POOL_CHECKED_OUT = Gauge("rifa_db_pool_checked_out", "Conexiones del pool en uso", multiprocess_mode="livesum")
+PICKS = Counter("rifa_picks_total", "Números pedidos, por resultado", ["result"])
+STARTUP_SECONDS = Gauge("rifa_worker_startup_seconds", "Tiempo de importación de la app en cada worker", multiprocess_mode="liveall")
+EXPORT_BYTES = Histogram("rifa_export_bytes", "Tamaño de las exportaciones", ["kind", "fmt"], buckets=(1e3, 1e4, 5e4, 1e5, 5e5, 1e6, 5e6))
+
+# Depuración por pedido (solo admins, ver _debug_start) y log de consultas lentas
+DEBUG_DIR = os.environ.get("DEBUG_DIR", os.path.join(tempfile.gettempdir(), "rifa-debug"))
+DEBUG_MAX_FILES = int(os.environ.get("DEBUG_MAX_FILES", "200"))         # volcados que se guardan
+DEBUG_TTL_SECONDS = int(os.environ.get("DEBUG_TTL_SECONDS", "86400"))
+SLOW_QUERY_MS = float(os.environ.get("SLOW_QUERY_MS", "250"))   # 0 = sin log
+
+@event.listens_for(engine, "before_cursor_execute")
+def _query_start(conn, cursor, statement, parameters, context, executemany):
+    conn.info.setdefault("query_start", []).append(time.perf_counter())
+
+@event.listens_for(engine, "after_cursor_execute")
+def _query_end(conn, cursor, statement, parameters, context, executemany):
+    elapsed = time.perf_counter() - conn.info["query_start"].pop()
+    if SLOW_QUERY_MS and elapsed * 1000 >= SLOW_QUERY_MS:
+        app.logger.warning("consulta lenta (%.1f ms): %s", elapsed * 1000, " ".join(statement.split()))
+    if has_request_context():
+        g.db_time = g.get("db_time", 0.0) + elapsed
+        g.db_queries = g.get("db_queries", 0) + 1
+        trace = g.get("sql_trace")
+        if trace is not None:
+            trace.append((statement, elapsed))
+
+@event.listens_for(engine, "connect")
+def _pool_connect(dbapi_conn, record):
+    POOL_CONNECTS.inc()
+
+@event.listens_for(engine, "checkout")
+def _pool_checkout(dbapi_conn, record, proxy):
+    POOL_CHECKOUTS.inc()
+    POOL_CHECKED_OUT.inc()
+
+@event.listens_for(engine, "checkin")
+def _pool_checkin(dbapi_conn, record):
+    POOL_CHECKED_OUT.dec()
+
+if read_engine is not engine:
+    # La réplica suma en las mismas métricas de consultas y pool
+    for name, listener in (("before_cursor_execute", _query_start), ("after_cursor_execute", _query_end),
+                           ("connect", _pool_connect), ("checkout", _pool_checkout), ("checkin", _pool_checkin)):
+        event.listen(read_engine, name, listener)
+
+def observe_write(op, t0, t_locked):
+    # wait: hasta que la primera escritura de la transacción consiguió el lock
+    # (fila de board_meta en Postgres, la base entera en SQLite); hold: de ahí al commit
+    WRITE_LOCK_WAIT.labels(op).observe(t_locked - t0)
+    WRITE_LOCK_HOLD.labels(op).observe(time.perf_counter() - t_locked)
 
 # --- Claves de administración ---
 ADMIN_VIEW_KEY = os.environ.get("ADMIN_VIEW_KEY", "")  # ver panel admin
@@ -37,501 +173,1851 @@ try:
 except ValueError:
     PRICE_PER_NUMBER = 10.0
 
+# --- Tamaño del tablero: 100 => 00-99, 1000 => 000-999, 10000 => 0000-9999 ---
+try:
+    BOARD_SIZE = min(max(int(os.environ.get("BOARD_SIZE", "100")), 10), 10000)
+except ValueError:
+    BOARD_SIZE = 100
+# A partir de este tamaño la grilla se dibuja en el cliente, solo la parte visible
+GRID_VIRTUAL_FROM = int(os.environ.get("GRID_VIRTUAL_FROM", "1000"))
+
+# --- Rifas ---
+# Un deploy puede atender varias rifas, cada una en /r/<slug>/ con sus datos,
+# su tablero, su versión y sus caches. La rifa 1 es la de siempre: se sirve
+# también en "/" y toma sus datos de las variables de entorno (RAFFLE_*,
+# BOARD_SIZE), así un deploy de una sola rifa no cambia. Las demás se crean
+# con "flask raffle-create".
+DEFAULT_RAFFLE_ID = 1
+DEFAULT_RAFFLE_SLUG = os.environ.get("RAFFLE_SLUG", "principal")
+SLUG_RE = re.compile(r"^[a-z0-9][a-z0-9-]{0,39}$")
+
+class Raffle(Base):
+    __tablename__ = "raffles"
+    id = Column(Integer, primary_key=True)
+    slug = Column(String(40), unique=True, nullable=False)
+    title = Column(String(200), default="", nullable=False)
+    price = Column(String(300), default="", nullable=False)       # premios
+    date = Column(String(300), default="", nullable=False)
+    price_value = Column(Float, default=10.0, nullable=False)     # precio por número
+    bank_info = Column(String(500), default="", nullable=False)
+    size = Column(Integer, default=100, nullable=False)
+
+# Nombre normalizado (ver normalize_name) para buscar participantes por
+# prefijo con el índice. Collation "C" en Postgres: orden por bytes, como
+# BINARY en SQLite, así el rango [prefijo, prefijo_siguiente) usa el índice.
+NAME_KEY_TYPE = String(80) if IS_SQLITE else String(80, collation="C")
+
 class NumberPick(Base):
     __tablename__ = "number_picks"
-    id = Column(Integer, primary_key=True)      # 0..99
+    __table_args__ = (Index("ix_number_picks_raffle_name", "raffle_id", "name_key"),)
+    # Clave (raffle_id, id): el índice de la PK sirve a todas las consultas por rifa
+    raffle_id = Column(Integer, primary_key=True, default=DEFAULT_RAFFLE_ID)
+    id = Column(Integer, primary_key=True, autoincrement=False)      # 0..size-1
     taken = Column(Boolean, default=False, nullable=False)
     name = Column(String(80), default="", nullable=False)
+    name_key = Column(NAME_KEY_TYPE, default="", server_default="", nullable=False)
     updated_at = Column(DateTime, default=datetime.datetime.utcnow, nullable=False)
 
-def init_db():
-    Base.metadata.create_all(engine)
+# Contadores compartidos por todos los workers (ej. "version" del tablero).
+# Cada escritura incrementa "version" en la misma transacción, así cualquier
+# proceso puede saber si su copia en memoria del estado quedó vieja. Las
+# claves de la rifa 1 no llevan sufijo; las de las demás, ":<id>" (ver Board.key).
+class BoardMeta(Base):
+    __tablename__ = "board_meta"
+    key = Column(String(40), primary_key=True)
+    value = Column(Integer, default=0, nullable=False)
+
+# Historial de cambios (append-only). seq es la versión del tablero que produjo
+# el cambio; se escribe en la misma transacción que el pick/release/reset.
+class NumberEvent(Base):
+    __tablename__ = "number_events"
+    __table_args__ = (Index("ix_number_events_raffle_seq", "raffle_id", "seq"),)
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    raffle_id = Column(Integer, nullable=False, default=DEFAULT_RAFFLE_ID)
+    seq = Column(Integer, nullable=False, index=True)
+    num = Column(Integer, nullable=False)
+    taken = Column(Boolean, nullable=False)
+    name = Column(String(80), default="", nullable=False)
+    created_at = Column(DateTime, default=datetime.datetime.utcnow, nullable=False)
+
+# Versiones a conservar en number_events al compactar
+EVENTS_KEEP = int(os.environ.get("EVENTS_KEEP", "10000"))
+EVENTS_COMPACT_SECONDS = int(os.environ.get("EVENTS_COMPACT_SECONDS", "3600"))
+
+# --- Motor del tablero: la base (default) o memoria + journal (memstore.py) ---
+# Con BOARD_STORE=journal cada worker tiene el tablero en memoria y lo lee sin
+# consultas SQL; picks/releases/resets van a un journal con fsync y lock de
+# archivo compartido entre workers. La base se sigue usando para board_meta
+# (poll_interval) y, la primera vez, para importar el estado actual. Cada rifa
+# tiene su journal y su lock: la 1 en BOARD_JOURNAL_DIR, las demás en
+# BOARD_JOURNAL_DIR/rifa-<id>.
+BOARD_STORE = os.environ.get("BOARD_STORE", "db")
+BOARD_JOURNAL_DIR = os.environ.get("BOARD_JOURNAL_DIR", "/var/data/board-journal")
+BOARD_SNAPSHOT_EVERY = int(os.environ.get("BOARD_SNAPSHOT_EVERY", "5000"))
+BOARD_JOURNAL_FSYNC = os.environ.get("BOARD_JOURNAL_FSYNC", "1") != "0"
+
+# Errores de escritura que las rutas convierten en ERROR_DB
+STORE_ERRORS = (OperationalError, OSError)
+
+def open_store(board, initial=None):
+    # Solo abre archivos, nada de base. initial(): filas para importar si el
+    # journal está vacío (bootstrap() lo reabre así para la rifa 1)
+    if BOARD_STORE != "journal":
+        return None
+    from memstore import JournalBoard       # usa fcntl: solo Linux/macOS
+    path = BOARD_JOURNAL_DIR if board.id == DEFAULT_RAFFLE_ID else os.path.join(BOARD_JOURNAL_DIR, f"rifa-{board.id}")
+    store = JournalBoard(
+        path, board.size,
+        history=EVENTS_KEEP, snapshot_every=BOARD_SNAPSHOT_EVERY, fsync=BOARD_JOURNAL_FSYNC,
+    )
+    return store.open(initial=initial)
+
+def db_rows(board):
     s = Session()
     try:
-        if s.query(NumberPick).count() == 0:
-            for i in range(100):
-                s.add(NumberPick(id=i, taken=False, name=""))
+        yield from s.execute(
+            select(NumberPick.id, NumberPick.taken, NumberPick.name, NumberPick.updated_at)
+            .where(NumberPick.raffle_id == board.id)
+            .order_by(NumberPick.id.asc())
+        )
+    finally:
+        s.close()
+
+def board_rows(board, s, taken_only=False):
+    # (id, ocupado, nombre, actualizado) de todo el tablero, en orden
+    if board.store is not None:
+        board.store.refresh()
+        return (r for r in board.store.rows() if r[1] or not taken_only)
+    q = (
+        select(NumberPick.id, NumberPick.taken, NumberPick.name, NumberPick.updated_at)
+        .where(NumberPick.raffle_id == board.id, NumberPick.id < board.size)
+        .order_by(NumberPick.id.asc())
+    )
+    if taken_only:
+        q = q.where(NumberPick.taken == True)
+    return s.execute(q.execution_options(yield_per=500))
+
+def normalize_name(name):
+    # "  José  PÉREZ " -> "jose perez": sin tildes, minúsculas y espacios simples
+    name = "".join(c for c in unicodedata.normalize("NFKD", name) if not unicodedata.combining(c))
+    return " ".join(name.casefold().split())[:80]
+
+def meta_key(raffle_id, name):
+    # La rifa 1 conserva las claves de board_meta de antes ("version", ...)
+    return name if raffle_id == DEFAULT_RAFFLE_ID else f"{name}:{raffle_id}"
+
+def insert_ignore(model):
+    # INSERT ... ON CONFLICT DO NOTHING (SQLite y Postgres)
+    return (sqlite_dialect if IS_SQLITE else postgresql).insert(model).on_conflict_do_nothing()
+
+BOOTSTRAP_LOCK_ID = 7200099     # pg_advisory_xact_lock de init_db
+
+def migrate_schema(conn):
+    # Bases de antes de las rifas: number_picks con clave solo "id" y
+    # number_events sin raffle_id. Todo lo existente pasa a ser de la rifa 1.
+    insp = inspect(conn)
+    tables = insp.get_table_names()
+    columns = lambda table: {c["name"] for c in insp.get_columns(table)}
+    if "number_events" in tables and "raffle_id" not in columns("number_events"):
+        conn.execute(text(f"ALTER TABLE number_events ADD COLUMN raffle_id INTEGER NOT NULL DEFAULT {DEFAULT_RAFFLE_ID}"))
+        conn.execute(text("CREATE INDEX ix_number_events_raffle_seq ON number_events (raffle_id, seq)"))
+    if "number_picks" in tables and "raffle_id" not in columns("number_picks"):
+        if IS_SQLITE:
+            # SQLite no cambia la clave primaria con ALTER: se copia a una tabla nueva
+            conn.execute(text("ALTER TABLE number_picks RENAME TO number_picks_old"))
+            NumberPick.__table__.create(conn)
+            conn.execute(text(
+                "INSERT INTO number_picks (raffle_id, id, taken, name, updated_at) "
+                f"SELECT {DEFAULT_RAFFLE_ID}, id, taken, name, updated_at FROM number_picks_old"
+            ))
+            conn.execute(text("DROP TABLE number_picks_old"))
+        else:
+            pkey = insp.get_pk_constraint("number_picks")["name"]
+            conn.execute(text(f"ALTER TABLE number_picks ADD COLUMN raffle_id INTEGER NOT NULL DEFAULT {DEFAULT_RAFFLE_ID}"))
+            conn.execute(text(f'ALTER TABLE number_picks DROP CONSTRAINT "{pkey}"'))
+            conn.execute(text("ALTER TABLE number_picks ADD PRIMARY KEY (raffle_id, id)"))
+    insp = inspect(conn)        # el inspector cachea columnas: releer después de migrar
+    if "number_picks" in tables and "name_key" not in {c["name"] for c in insp.get_columns("number_picks")}:
+        collate = "" if IS_SQLITE else ' COLLATE "C"'
+        conn.execute(text(f"ALTER TABLE number_picks ADD COLUMN name_key VARCHAR(80){collate} NOT NULL DEFAULT ''"))
+        conn.execute(text("CREATE INDEX ix_number_picks_raffle_name ON number_picks (raffle_id, name_key)"))
+    if "number_picks" in tables:
+        # Ocupados de antes de name_key (o de la copia de arriba): completar la clave
+        rows = conn.execute(
+            select(NumberPick.raffle_id, NumberPick.id, NumberPick.name)
+            .where(NumberPick.taken == True, NumberPick.name_key == "")
+        ).all()
+        if rows:
+            conn.execute(
+                update(NumberPick)
+                .where(NumberPick.raffle_id == bindparam("r"), NumberPick.id == bindparam("i"))
+                .values(name_key=bindparam("k")),
+                [{"r": r, "i": i, "k": normalize_name(name)} for r, i, name in rows],
+            )
+
+def init_db():
+    # Esquema + siembra, idempotente. No corre al importar: lo llama el hook
+    # on_starting de gunicorn (una vez, en el master) o "flask bootstrap".
+    # Todo va en una transacción con el lock de escritura tomado (BEGIN
+    # IMMEDIATE en SQLite, advisory lock en Postgres), así aunque arranquen
+    # varios procesos a la vez no hay carreras con create_all ni la siembra.
+    s = WriteSession()
+    try:
+        if not IS_SQLITE:
+            s.execute(select(func.pg_advisory_xact_lock(BOOTSTRAP_LOCK_ID)))
+        migrate_schema(s.connection())
+        Base.metadata.create_all(s.connection())
+        # La fila de la rifa 1 se actualiza con el entorno en cada deploy
+        default = raffle_values(default_raffle())
+        s.execute(insert_ignore(Raffle), [{"id": DEFAULT_RAFFLE_ID, **default}])
+        s.execute(update(Raffle).where(Raffle.id == DEFAULT_RAFFLE_ID).values(**default))
+        inserted = 0
+        for raffle in s.execute(select(Raffle)).scalars().all():
+            inserted += seed_numbers(raffle, s)
+            s.execute(insert_ignore(BoardMeta), [
+                {"key": meta_key(raffle.id, key), "value": 0} for key in ("version", "events_floor")
+            ])
+        s.execute(insert_ignore(BoardMeta), [{"key": "poll_interval", "value": 0}])
+        s.commit()
+        return inserted
+    finally:
+        s.close()
+
+def seed_numbers(raffle, s=None):
+    # Alta masiva (un executemany) de los números que falten: tablero nuevo o
+    # agrandado. "raffle" es un Raffle o un Board (usa id y size). Devuelve
+    # cuántas filas se insertaron. Con "s" usa esa transacción y no hace commit.
+    if s is None:
+        s = WriteSession()
+        try:
+            inserted = seed_numbers(raffle, s)
             s.commit()
+            return inserted
+        finally:
+            s.close()
+    existing = set(s.execute(select(NumberPick.id).where(NumberPick.raffle_id == raffle.id)).scalars())
+    missing = [i for i in range(raffle.size) if i not in existing]
+    if missing:
+        now = datetime.datetime.utcnow()
+        s.execute(insert_ignore(NumberPick), [
+            {"raffle_id": raffle.id, "id": i, "taken": False, "name": "", "updated_at": now} for i in missing
+        ])
+    return len(missing)
+
+def parse_num_spec(board, text):
+    # "01,05,10-20" -> [(1, 1), (5, 5), (10, 20)]; lista vacía = todos
+    spans = []
+    for token in text.replace(" ", ",").split(","):
+        if not token:
+            continue
+        start, _, end = token.partition("-")
+        if not (start.isdigit() and (end.isdigit() or not end)):
+            raise ValueError(f"Número o rango inválido: {token}")
+        start, end = int(start), int(end or start)
+        if not (0 <= start <= end < board.size):
+            raise ValueError(f"Fuera del tablero: {token}")
+        spans.append((start, end))
+    return spans
+
+def numbers_filter(spans):
+    singles = [a for a, b in spans if a == b]
+    conds = [NumberPick.id.between(a, b) for a, b in spans if a != b]
+    if singles:
+        conds.append(NumberPick.id.in_(singles))
+    return or_(*conds)
+
+def claim_numbers(board, ids, name, atomic=True):
+    # Reserva atómica: un único UPDATE ... WHERE taken = false, así solo una
+    # transacción puede ocupar cada número sin importar cuántos workers compitan.
+    # Con atomic=True es todo o nada. Devuelve (reservados, ya ocupados, versión, libres).
+    if board.store is not None:
+        try:
+            claimed, busy, seq, free, t0, t_locked = board.store.claim(ids, name, atomic)
+        except OSError:
+            PICKS.labels("error").inc(len(ids))
+            raise
+        observe_write("pick", t0, t_locked)
+        if claimed:
+            PICKS.labels("ok").inc(len(claimed))
+            board.feed.poke()
+            note_write(board, seq)
+        PICKS.labels("conflict").inc(len(busy) if claimed else len(ids))
+        return claimed, busy, seq, free
+    s = WriteSession()
+    try:
+        t0 = time.perf_counter()
+        res = s.execute(
+            update(NumberPick)
+            .where(NumberPick.raffle_id == board.id, NumberPick.id.in_(ids), NumberPick.taken == False)
+            .values(taken=True, name=name, name_key=normalize_name(name), updated_at=datetime.datetime.utcnow())
+            .returning(NumberPick.id)
+            .execution_options(synchronize_session=False)
+        )
+        claimed = sorted(res.scalars().all())
+        t_locked = time.perf_counter()
+        busy = sorted(set(ids) - set(claimed))
+        if not claimed or (atomic and busy):
+            s.rollback()
+            observe_write("pick", t0, t_locked)
+            PICKS.labels("conflict").inc(len(ids))
+            return [], busy, None, None
+        seq = bump_version(board, s)
+        log_changes(board, s, seq, [(i, True, name) for i in claimed])
+        free = free_count(board, s)
+        s.commit()
+        observe_write("pick", t0, t_locked)
+        PICKS.labels("ok").inc(len(claimed))
+        PICKS.labels("conflict").inc(len(busy))
+        board.feed.poke()
+        note_write(board, seq)
+        return claimed, busy, seq, free
+    except OperationalError:
+        PICKS.labels("error").inc(len(ids))
+        raise
     finally:
         s.close()
 
-app = Flask(__name__)
-init_db()
-
-HTML = """
-<!doctype html>
-<html lang="es">
-<head>
-<meta charset="utf-8"><meta name="viewport" content="width=device-width,initial-scale=1">
-<title>{{ raffle_title }}</title>
-<style>
-  :root{ --primary:#14ae5c; --muted:#555; --bgfree:#f6fff6; --bgtaken:#fff4f4; }
-  body{font-family:system-ui,-apple-system,Segoe UI,Roboto,Ubuntu,Helvetica,Arial,sans-serif;margin:20px}
-  .wrap{max-width:920px;margin:auto}
-  h1{margin:0 0 4px}
-  .meta{color:var(--muted);margin-bottom:16px}
-  .banner{border:1px solid #e5e5e5; border-radius:14px; padding:12px 14px; margin:8px 0 12px; display:flex; gap:10px; align-items:center; background:#fafafa;}
-  .badge{background:var(--primary);color:#fff;padding:4px 10px;border-radius:999px;font-weight:600}
-  .bank-btns{display:flex; gap:8px; flex-wrap:wrap; margin:8px 0 14px}
-  .bank-inline{background:#e8f3ff;border:1px solid #cfe4ff;color:#0b3d91;border-radius:12px;padding:8px 10px}
-  .grid{display:grid;grid-template-columns:repeat(10,1fr);gap:8px}
-  .cell{padding:10px;border-radius:10px;text-align:center;border:1px solid #ddd}
-  .free{background:var(--bgfree)}
-  .taken{background:var(--bgtaken);color:#555}
-  .cell small{display:block;font-size:12px;color:#666;margin-top:4px}
-  .topbar{display:flex;gap:8px;align-items:center;margin:12px 0 16px; flex-wrap:wrap}
-  input[type=text]{padding:8px;border:1px solid #ccc;border-radius:8px;min-width:180px}
-  button{padding:8px 10px;border:0;border-radius:10px;cursor:pointer}
-  .pick{background:var(--primary);color:white}
-  .admin-dl{display:flex;gap:8px;align-items:center;flex-wrap:wrap}
-  .admin-dl input{flex:0 0 200px}
-  .disabled{opacity:.6;cursor:not-allowed}
-  details{margin-top:24px}
-  .row{display:flex;gap:8px;align-items:center;margin:6px 0}
-  .mono{font-variant-numeric:tabular-nums}
-
-  /* Modal bancario */
-  .modal-backdrop{
-    position:fixed; inset:0; background:rgba(0,0,0,.45); display:none; align-items:center; justify-content:center; z-index:9999;
-  }
-  .modal{background:#fff; border-radius:16px; max-width:560px; width:92%; padding:16px; box-shadow:0 10px 30px rgba(0,0,0,.2)}
-  .modal h2{margin:0 0 8px}
-  .modal p{margin:8px 0 0; word-break:break-word}
-  .modal .actions{display:flex; gap:8px; justify-content:flex-end; margin-top:14px; flex-wrap:wrap}
-  .modal .ghost{background:#f2f2f2}
-</style>
-</head>
-<body>
-<div class="wrap">
-  <h1>{{ raffle_title }}</h1>
-  <div class="banner">
-    <span class="badge">Rifa</span>
-    <div>
-      <div><strong>{{ raffle_price }}</strong></div>
-      <div>{{ raffle_date }}</div>
-    </div>
-  </div>
-
-  {% if bank_info %}
-    <div class="bank-btns">
-      <span class="bank-inline"><strong>Datos bancarios disponibles</strong></span>
-      <button type="button" onclick="openBankModal()">Ver datos bancarios</button>
-      <button type="button" onclick="copyBankInfo()">Copiar</button>
-    </div>
-  {% endif %}
-
-  {% if error_msg %}
-    <div class="bank-inline" style="background:#fff3cd;border-color:#ffeeba;color:#856404;">
-      {{ error_msg }}
-    </div>
-  {% endif %}
-
-  <div class="meta">Números libres: <strong id="free-count">{{ free_count }}</strong> / 100</div>
-
-  <div class="topbar">
-    <input id="nombre" type="text" placeholder="Tu nombre (obligatorio)" />
-    <button onclick="share()">Compartir enlace</button>
-
-    <!-- Descarga para organizador por clave (ADMIN_KEY) -->
-    <div class="admin-dl">
-      <input id="adminKeyForDownload" type="text" placeholder="ADMIN_KEY para descargar Excel" />
-      <button onclick="downloadExcel()">Exportar Excel</button>
-      <button onclick="downloadExcelOcupados()">Exportar ocupados + total</button>
-    </div>
-  </div>
-
-  <div class="grid" id="grid">
-    {% for n in numbers %}
-      <div class="cell {% if n.taken %}taken{% else %}free{% endif %}" 
-           id="cell-{{'%02d' % n.id}}" 
-           data-num="{{'%02d' % n.id}}" 
-           data-taken="{{ 1 if n.taken else 0 }}" 
-           data-name="{{ n.name|e }}">
-        <div class="mono"><strong>{{ "%02d" % n.id }}</strong></div>
-        {% if not n.taken %}
-          <button class="pick" type="button" onclick="pickNumber('{{ '%02d' % n.id }}', this)">Elegir</button>
-        {% else %}
-          <small>Ocupado por: {{ n.name }}</small>
-        {% endif %}
-      </div>
-    {% endfor %}
-  </div>
-
-  {% if show_admin %}
-  <details open>
-    <summary>Administración</summary>
-    <p>Para liberar o reiniciar necesitás la clave de admin (<code>ADMIN_KEY</code>).</p>
-    <form class="row" method="post" action="{{ url_for('release', num='00') }}" onsubmit="this.action=this.action.replace('00', document.getElementById('numlib').value);">
-      <input id="numlib" type="text" placeholder="Número (00–99)" pattern="\\d\\d" maxlength="2">
-      <input name="key" type="text" placeholder="ADMIN_KEY">
-      <button type="submit">Liberar</button>
-    </form>
-    <form class="row" method="post" action="{{ url_for('reset') }}">
-      <input name="key" type="text" placeholder="ADMIN_KEY">
-      <button type="submit">Reiniciar todo</button>
-    </form>
-    <div class="row"><a href="{{ url_for('api_state') }}">Ver estado (JSON)</a></div>
-    <div class="row"><a href="{{ url_for('export_excel') }}">Exportar a Excel</a></div>
-    <div class="row"><a href="{{ url_for('export_occupied_excel') }}">Exportar ocupados + total</a></div>
-    <div class="row"><a href="{{ url_for('admin_logout') }}">Cerrar panel</a></div>
-  </details>
-  {% endif %}
-</div>
-
-{% if bank_info %}
-<!-- Modal de datos bancarios -->
-<div id="bankModal" class="modal-backdrop" role="dialog" aria-modal="true" aria-labelledby="bankTitle">
-  <div class="modal">
-    <h2 id="bankTitle">Datos bancarios</h2>
-    <p id="bankText">{{ bank_info }}</p>
-    <div class="actions">
-      <button class="ghost" type="button" onclick="closeBankModal()">Cerrar</button>
-      <button type="button" onclick="copyBankInfo()">Copiar</button>
-    </div>
-  </div>
-</div>
-{% endif %}
-
-<script>
-function share(){
-  if (navigator.share){ navigator.share({title:document.title, url: window.location.href}); }
-  else { navigator.clipboard.writeText(window.location.href); alert("Enlace copiado. Pegalo en el grupo de WhatsApp."); }
-}
+def reset_numbers(board, spans=None):
+    # Libera con un solo UPDATE ... RETURNING los números ocupados, todos o solo
+    # los de "spans", y anota en el historial los que devolvió. Mismo orden de
+    # locks que claim_numbers y release_number (primero number_picks, después
+    # la versión) para no trabarse con ellos en Postgres. Devuelve (filas
+    # liberadas, versión).
+    if board.store is not None:
+        ids = [i for a, b in spans for i in range(a, b + 1)] if spans else None
+        count, seq, t0, t_locked = board.store.release(ids)
+        observe_write("reset", t0, t_locked)
+        if count:
+            board.feed.poke()
+            note_write(board, seq)
+        return count, seq
+    s = WriteSession()
+    try:
+        now = datetime.datetime.utcnow()
+        where = [NumberPick.raffle_id == board.id, NumberPick.taken == True]
+        if spans:
+            where.append(numbers_filter(spans))
+        t0 = time.perf_counter()
+        res = s.execute(
+            update(NumberPick)
+            .where(*where)
+            .values(taken=False, name="", name_key="", updated_at=now)
+            .returning(NumberPick.id)
+            .execution_options(synchronize_session=False)
+        )
+        released = sorted(res.scalars().all())
+        t_locked = time.perf_counter()
+        if not released:
+            s.rollback()
+            observe_write("reset", t0, t_locked)
+            return 0, current_version(board, s)
+        seq = bump_version(board, s)
+        log_changes(board, s, seq, [(i, False, "") for i in released])
+        s.commit()
+        observe_write("reset", t0, t_locked)
+        board.feed.poke()
+        note_write(board, seq)
+        return len(released), seq
+    finally:
+        s.close()
 
-// Botones de descarga con clave
-function downloadExcel(){
-  const k = (document.getElementById('adminKeyForDownload') || {}).value || "";
-  if(!k){ alert("Ingresá la ADMIN_KEY para descargar."); return; }
-  window.location.href = `/export.xlsx?key=${encodeURIComponent(k)}`;
-}
-function downloadExcelOcupados(){
-  const k = (document.getElementById('adminKeyForDownload') || {}).value || "";
-  if(!k){ alert("Ingresá la ADMIN_KEY para descargar."); return; }
-  window.location.href = `/export-ocupados.xlsx?key=${encodeURIComponent(k)}`;
-}
+def release_number(board, idx):
+    if board.store is not None:
+        count, seq, t0, t_locked = board.store.release([idx])
+        observe_write("release", t0, t_locked)
+        if count:
+            board.feed.poke()
+            note_write(board, seq)
+        return count
+    s = WriteSession()
+    try:
+        t0 = time.perf_counter()
+        res = s.execute(
+            update(NumberPick)
+            .where(NumberPick.raffle_id == board.id, NumberPick.id == idx, NumberPick.taken == True)
+            .values(taken=False, name="", name_key="", updated_at=datetime.datetime.utcnow())
+        )
+        t_locked = time.perf_counter()
+        if res.rowcount:
+            seq = bump_version(board, s)
+            log_changes(board, s, seq, [(idx, False, "")])
+            s.commit()
+            board.feed.poke()
+            note_write(board, seq)
+        observe_write("release", t0, t_locked)
+        return res.rowcount
+    finally:
+        s.close()
 
-// Modal bancario
-function openBankModal(){
-  const m = document.getElementById('bankModal'); if(m){ m.style.display='flex'; }
-}
-function closeBankModal(){
-  const m = document.getElementById('bankModal'); if(m){ m.style.display='none'; }
-}
-async function copyBankInfo(){
-  const el = document.getElementById('bankText');
-  if(!el) return;
-  try{
-    await navigator.clipboard.writeText(el.textContent);
-    alert("Datos bancarios copiados.");
-  }catch(e){
-    // Fallback para navegadores antiguos
-    const ta = document.createElement('textarea');
-    ta.value = el.textContent;
-    document.body.appendChild(ta);
-    ta.select(); document.execCommand('copy');
-    document.body.removeChild(ta);
-    alert("Datos bancarios copiados.");
-  }
-}
-// Abrir modal automáticamente si ?bank=1
-(function(){
-  const params = new URLSearchParams(window.location.search);
-  if(params.get('bank') === '1'){ openBankModal(); }
-})();
-
-// Render helpers
-function renderFreeCell(num){
-  return `
-    <div class="mono"><strong>${num}</strong></div>
-    <button class="pick" type="button" onclick="pickNumber('${num}', this)">Elegir</button>
-  `;
-}
-function renderTakenCell(num, name){
-  return `
-    <div class="mono"><strong>${num}</strong></div>
-    <small>Ocupado por: ${name ? name.replace(/</g,"&lt;").replace(/>/g,"&gt;") : ""}</small>
-  `;
-}
+def current_version(board, s):
+    if board.store is not None:
+        board.store.refresh()
+        return board.store.version
+    return s.execute(select(BoardMeta.value).where(BoardMeta.key == board.key("version"))).scalar_one()
 
-// Elegir número (validación + confirmación)
-async function pickNumber(num, btn){
-  const nameInput = document.getElementById('nombre');
-  const name = nameInput ? nameInput.value.trim() : "";
-  if(!name){
-    alert("Escribí tu nombre para poder elegir.");
-    if(nameInput) nameInput.focus();
-    return;
-  }
-  if(!confirm(`¿Confirmás elegir el número ${num} a nombre de "${name}"?`)){
-    return;
-  }
-  if(btn){ btn.disabled = true; }
-  try{
-    const fd = new FormData();
-    fd.append('name', name);
-    const res = await fetch(`/pick/${num}`, {
-      method:'POST',
-      headers: {'X-Requested-With':'XMLHttpRequest'},
-      body: fd
-    });
-    if(!res.ok){
-      const txt = await res.text();
-      alert(txt || "No se pudo completar la reserva.");
-      return;
-    }
-    await refreshState();
-  }catch(e){
-    alert("No se pudo completar la reserva. Revisá tu conexión e intentá de nuevo.");
-  }finally{
-    if(btn){ btn.disabled = false; }
-  }
-}
+def bump_version(board, s):
+    # Se llama dentro de la transacción de escritura, antes del commit. En
+    # Postgres la fila "version" de cada rifa es su lock de escritura: las
+    # escrituras de rifas distintas no se esperan entre sí.
+    s.execute(
+        update(BoardMeta)
+        .where(BoardMeta.key == board.key("version"))
+        .values(value=BoardMeta.value + 1)
+    )
+    return current_version(board, s)
+
+def log_changes(board, s, seq, changes):
+    # changes: lista de (num, taken, name)
+    if changes:
+        now = datetime.datetime.utcnow()
+        s.execute(insert(NumberEvent), [
+            {"raffle_id": board.id, "seq": seq, "num": num, "taken": taken, "name": name, "created_at": now}
+            for num, taken, name in changes
+        ])
 
-// Polling cada 5s
-async function refreshState(){
-  try{
-    const res = await fetch('/api/state', {cache:'no-store'});
-    if(!res.ok) return;
-    const data = await res.json();
-    let freeCount = 0;
-    for(const item of data){
-      const id = 'cell-' + item.num;
-      const el = document.getElementById(id);
-      if(!el) continue;
-      const prevTaken = el.getAttribute('data-taken') === '1';
-      if(item.taken){
-        el.classList.remove('free'); el.classList.add('taken');
-        el.setAttribute('data-taken','1');
-        el.setAttribute('data-name', item.name || "");
-        if(!prevTaken){ el.innerHTML = renderTakenCell(item.num, item.name || ""); }
-      }else{
-        freeCount++;
-        el.classList.remove('taken'); el.classList.add('free');
-        el.setAttribute('data-taken','0');
-        el.setAttribute('data-name','');
-        if(prevTaken){ el.innerHTML = renderFreeCell(item.num); }
-      }
+def changes_since(board, s, since):
+    # Devuelve (version, eventos) con los cambios posteriores a "since", o
+    # (version, None) si el historial ya fue compactado y hace falta resync.
+    if board.store is not None:
+        board.store.refresh()
+        return board.store.changes_since(since)
+    version = current_version(board, s)
+    if since == version:
+        return version, []
+    floor = s.execute(select(BoardMeta.value).where(BoardMeta.key == board.key("events_floor"))).scalar_one()
+    if since < floor or since > version:
+        return version, None
+    rows = s.execute(
+        select(NumberEvent.seq, NumberEvent.num, NumberEvent.taken, NumberEvent.name)
+        .where(NumberEvent.raffle_id == board.id, NumberEvent.seq > since, NumberEvent.seq <= version)
+        .order_by(NumberEvent.seq.asc(), NumberEvent.id.asc())
+    ).all()
+    return version, rows
+
+def free_count(board, s):
+    if board.store is not None:
+        return board.store.free
+    return s.execute(
+        select(func.count()).select_from(NumberPick)
+        .where(NumberPick.raffle_id == board.id, NumberPick.taken == False, NumberPick.id < board.size)
+    ).scalar_one()
+
+def compact_events(board, keep=None):
+    # Borra el historial viejo y deja registrado hasta dónde se borró.
+    # Con el journal no hace falta: el historial en memoria ya está acotado.
+    if board.store is not None:
+        return 0
+    keep = EVENTS_KEEP if keep is None else keep
+    s = WriteSession()
+    try:
+        floor = current_version(board, s) - keep
+        if floor <= 0:
+            return 0
+        res = s.execute(delete(NumberEvent).where(NumberEvent.raffle_id == board.id, NumberEvent.seq <= floor))
+        s.execute(
+            update(BoardMeta)
+            .where(BoardMeta.key == board.key("events_floor"), BoardMeta.value < floor)
+            .values(value=floor)
+        )
+        s.commit()
+        return res.rowcount
+    finally:
+        s.close()
+
+# --- Snapshot de /api/state (serializado una vez por versión y por rifa) ---
+def compact_state(version, data):
+    # Formato compacto: bitmap de ocupados en base64 (bit i = número i, el bit
+    # menos significativo primero) y nombres solo de los ocupados, por número
+    bits = bytearray((len(data) + 7) // 8)
+    names = {}
+    for i, item in enumerate(data):
+        if item["taken"]:
+            bits[i >> 3] |= 1 << (i & 7)
+            names[i] = item["name"]
+    return {
+        "v": version,
+        "size": len(data),
+        "free": len(data) - len(names),
+        "bits": base64.b64encode(bytes(bits)).decode("ascii"),
+        "names": names,
     }
-    const fc = document.getElementById('free-count');
-    if(fc) fc.textContent = freeCount.toString();
-  }catch(e){}
-}
-setInterval(refreshState, 5000);
-</script>
-</body>
-</html>
-"""
 
-@app.get("/")
-def index():
+def state_snapshot(board):
+    s = read_session(board)
+    try:
+        version = current_version(board, s)
+        # Una réplica atrasada no hace retroceder el snapshot: el más nuevo sirve
+        newer = lambda snap: snap["version"] == version or (
+            s.get_bind() is not engine and snap["version"] is not None and snap["version"] > version
+        )
+        snap = board.snapshot
+        if newer(snap):
+            return snap
+        with board.snapshot_lock:
+            if newer(board.snapshot):
+                return board.snapshot
+            data = [
+                {"num": board.fmt(id_), "taken": taken, "name": name}
+                for id_, taken, name, _ in board_rows(board, s)
+            ]
+            compact = compact_state(version, data)
+            board.snapshot = {
+                "version": version,
+                "data": data,
+                "free": compact["free"],
+                "compact": compact,
+                "body": json.dumps(data, ensure_ascii=False, separators=(",", ":")).encode("utf-8"),
+                "compact_body": json.dumps(compact, ensure_ascii=False, separators=(",", ":")).encode("utf-8"),
+            }
+            return board.snapshot
+    finally:
+        s.close()
+
+# --- Stream de cambios (SSE) ---
+# Un único hilo por worker y por rifa lee number_events (sirve para ver
+# cambios hechos por otros workers) y reparte los cambios por celda a todas
+# las conexiones abiertas de esa rifa en ese worker. Con workers gevent cada
+# conexión es un greenlet, así que miles de espectadores no ocupan un worker
+# cada uno. Con gthread cada stream ocupa un hilo: pasados STREAM_MAX_OPEN
+# streams por worker se responde 503 y el navegador sigue por polling (0 = sin
+# límite). Un stream cortado libera su lugar recién cuando falla la escritura
+# de un heartbeat. La compactación del historial va aparte (_compact_loop).
+STREAM_POLL_SECONDS = float(os.environ.get("STREAM_POLL_SECONDS", "1"))
+STREAM_HEARTBEAT_SECONDS = 15
+STREAM_MAX_SECONDS = int(os.environ.get("STREAM_MAX_SECONDS", "600"))
+STREAM_MAX_OPEN = int(os.environ.get("STREAM_MAX_OPEN", "0"))
+stream_slots = {"open": 0}
+stream_slots_lock = threading.Lock()
+
+class ChangeFeed:
+    def __init__(self, board, maxlen=2000):
+        self.board = board
+        self.cond = threading.Condition()
+        self.wakeup = threading.Event()
+        self.version = None
+        self.base = None                            # versión desde la que hay historial
+        self.events = collections.deque(maxlen=maxlen)  # (version, [celdas])
+        self.thread = None
+
+    def start(self):
+        with self.cond:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self._run, name=f"change-feed-{self.board.slug}", daemon=True)
+                self.thread.start()
+
+    def poke(self):
+        # Las escrituras de este worker avisan para no esperar al próximo poll
+        self.wakeup.set()
+
+    def _run(self):
+        while True:
+            try:
+                self._check()
+            except Exception:
+                app.logger.exception("change feed %s: error leyendo cambios", self.board.slug)
+            self.wakeup.wait(STREAM_POLL_SECONDS)
+            self.wakeup.clear()
+
+    def _check(self):
+        board = self.board
+        s = Session()
+        try:
+            if self.version is None:
+                version, rows = current_version(board, s), None
+            else:
+                version, rows = changes_since(board, s, self.version)
+                free = free_count(board, s) if rows else None
+        finally:
+            s.close()
+        if version == self.version:
+            return
+        with self.cond:
+            if rows is None:
+                # Arranque (o historial compactado): no hay cambios para repartir
+                self.events.clear()
+                self.base = version
+            else:
+                by_seq = collections.defaultdict(list)
+                for seq, num, taken, name in rows:
+                    by_seq[seq].append({"num": board.fmt(num), "taken": taken, "name": name, "version": seq, "free": free})
+                for seq in sorted(by_seq):
+                    self.events.append((seq, by_seq[seq]))
+                if len(self.events) == self.events.maxlen:
+                    self.base = self.events[0][0] - 1
+            self.version = version
+            self.cond.notify_all()
+
+    def wait(self, since, timeout):
+        # Devuelve (version, eventos, resync). resync=True si el cliente tiene
+        # que recibir el estado completo porque no hay historial desde "since".
+        with self.cond:
+            if self.version is None:
+                self.cond.wait(timeout)
+            if self.version is None:
+                return None, [], False
+            if since is None or since < self.base or since > self.version:
+                return self.version, [], True
+            if since == self.version:
+                self.cond.wait(timeout)
+            events = [c for v, cells in self.events if v > since for c in cells]
+            return self.version, events, False
+
+# --- Tableros por rifa ---
+class Board:
+    # Una rifa en este worker: sus datos y todo su estado en memoria (snapshot,
+    # grilla renderizada, feed SSE, journal). Cada rifa tiene sus propios
+    # caches y locks, así el tráfico de una no invalida ni frena a las demás.
+    def __init__(self, raffle):
+        self.id = raffle.id
+        self.slug = raffle.slug
+        self.title = raffle.title
+        self.price = raffle.price
+        self.date = raffle.date
+        self.price_value = raffle.price_value
+        self.bank_info = raffle.bank_info
+        self.size = min(max(raffle.size, 10), 10000)
+        self.width = len(str(self.size - 1))
+        self.virtual = self.size >= GRID_VIRTUAL_FROM
+        # Prefijo de ETags, claves de cache e ids de exportación (vacío en la rifa 1)
+        self.tag = "" if self.id == DEFAULT_RAFFLE_ID else f"r{self.id}-"
+        # Huella de los datos que muestra la página: va en el ETag de "/", así
+        # corregir BANK_INFO o el título y redeployar no deja páginas viejas en 304
+        settings = json.dumps([self.title, self.price, self.date, self.bank_info, self.size])
+        self.settings_tag = hashlib.sha256(settings.encode("utf-8")).hexdigest()[:8]
+        self.snapshot = {"version": None, "data": [], "body": b""}
+        self.snapshot_lock = threading.Lock()
+        self.grid = {"version": None, "html": ""}
+        self.feed = ChangeFeed(self)
+        # La rifa 1 importa la base en bootstrap(); las demás al abrir por primera vez
+        initial = None if self.id == DEFAULT_RAFFLE_ID else (lambda: db_rows(self))
+        self.store = open_store(self, initial)
+
+    def key(self, name):
+        return meta_key(self.id, name)
+
+    def fmt(self, i):
+        return str(i).zfill(self.width)
+
+    def parse(self, num):
+        # "07" -> 7; None si no es un número válido del tablero
+        if len(num) == self.width and num.isdigit() and int(num) < self.size:
+            return int(num)
+        return None
+
+_boards = {}                    # slug -> Board, se arman a pedido
+_boards_lock = threading.Lock()
+
+def default_raffle():
+    # La rifa 1 sale del entorno, sin consultar la base
+    return Raffle(
+        id=DEFAULT_RAFFLE_ID, slug=DEFAULT_RAFFLE_SLUG, title=RAFFLE_TITLE, price=RAFFLE_PRICE,
+        date=RAFFLE_DATE, price_value=PRICE_PER_NUMBER, bank_info=BANK_INFO, size=BOARD_SIZE,
+    )
+
+def raffle_values(raffle):
+    return {c: getattr(raffle, c) for c in ("slug", "title", "price", "date", "price_value", "bank_info", "size")}
+
+def get_board(slug=DEFAULT_RAFFLE_SLUG):
+    # Board de la rifa o None si no existe. Los datos se leen de la base una
+    # sola vez por worker (cambiarlos requiere reiniciar).
+    board = _boards.get(slug)
+    if board is not None:
+        return board
+    if not SLUG_RE.match(slug):
+        return None
+    with _boards_lock:
+        if slug not in _boards:
+            if slug == DEFAULT_RAFFLE_SLUG:
+                raffle = default_raffle()
+            else:
+                s = Session()
+                try:
+                    raffle = s.execute(
+                        select(Raffle).where(Raffle.slug == slug, Raffle.id != DEFAULT_RAFFLE_ID)
+                    ).scalar_one_or_none()
+                finally:
+                    s.close()
+                if raffle is None:
+                    return None
+            _boards[slug] = Board(raffle)
+        return _boards[slug]
+
+def default_board():
+    return get_board(DEFAULT_RAFFLE_SLUG)
+
+def all_boards():
     s = Session()
     try:
-        numbers = s.query(NumberPick).order_by(NumberPick.id.asc()).all()
-        free_count = sum(1 for n in numbers if not n.taken)
-        show_admin = (
-            (request.args.get("admin", "") == ADMIN_VIEW_KEY and ADMIN_VIEW_KEY != "")
-            or (request.cookies.get("is_admin") == "1")
+        slugs = s.execute(
+            select(Raffle.slug).where(Raffle.id != DEFAULT_RAFFLE_ID).order_by(Raffle.id)
+        ).scalars().all()
+    finally:
+        s.close()
+    return [default_board()] + [b for b in map(get_board, slugs) if b is not None]
+
+def board_option(slug):
+    # Para los comandos con --raffle
+    board = get_board(slug or DEFAULT_RAFFLE_SLUG)
+    if board is None:
+        raise click.BadParameter(f"No existe la rifa {slug}", param_hint="--raffle")
+    return board
+
+# --- Intervalo de polling sugerido a los clientes (X-Poll-Interval) ---
+# El admin lo cambia en caliente (board_meta "poll_interval", 0 = el default)
+# para frenar a todos los navegadores bajo carga sin redeploy. Cada worker lo
+# relee como mucho cada POLL_HINT_TTL segundos.
+POLL_INTERVAL_SECONDS = int(os.environ.get("POLL_INTERVAL_SECONDS", "5"))
+POLL_INTERVAL_MAX = 600
+POLL_HINT_TTL = 10
+_poll_hint = {"at": 0.0, "value": POLL_INTERVAL_SECONDS}
+_poll_hint_lock = threading.Lock()
+
+def poll_interval():
+    with _poll_hint_lock:
+        if time.monotonic() - _poll_hint["at"] >= POLL_HINT_TTL:
+            s = Session()
+            try:
+                value = s.execute(
+                    select(BoardMeta.value).where(BoardMeta.key == "poll_interval")
+                ).scalar_one_or_none()
+            finally:
+                s.close()
+            _poll_hint["value"] = value or POLL_INTERVAL_SECONDS
+            _poll_hint["at"] = time.monotonic()
+        return _poll_hint["value"]
+
+def set_poll_interval(seconds):
+    # 0 vuelve al default (POLL_INTERVAL_SECONDS)
+    seconds = max(0, min(int(seconds), POLL_INTERVAL_MAX))
+    s = WriteSession()
+    try:
+        res = s.execute(
+            update(BoardMeta).where(BoardMeta.key == "poll_interval").values(value=seconds)
         )
-        error_msg = "Escribí tu nombre para poder elegir." if request.args.get("err") == "noname" else ""
-        return render_template_string(
-            HTML,
-            numbers=numbers,
-            free_count=free_count,
+        if not res.rowcount:
+            s.add(BoardMeta(key="poll_interval", value=seconds))
+        s.commit()
+    finally:
+        s.close()
+    with _poll_hint_lock:
+        _poll_hint["at"] = 0.0
+    return seconds or POLL_INTERVAL_SECONDS
+
+# --- Réplica de lectura (DATABASE_READ_URL) ---
+# Las lecturas de las rutas (estado, página, exportaciones, participantes) van
+# a la réplica mientras esté al día; las escrituras y el feed SSE, siempre a
+# la primaria. Cada worker compara cada REPLICA_CHECK_SECONDS las versiones
+# de board_meta en las dos bases: si la réplica sigue atrasada más de
+# REPLICA_MAX_LAG_SECONDS (o no responde) se lee de la primaria hasta que se
+# ponga al día. Después de escribir, el navegador recibe la cookie "wv" con
+# la versión que escribió; mientras la réplica no llegue a esa versión, sus
+# lecturas van a la primaria (lee lo que acaba de escribir). Para probar en
+# local alcanza con un segundo archivo SQLite como réplica, actualizado con
+# "sqlite3 state.db '.backup replica.db'".
+REPLICA_CHECK_SECONDS = float(os.environ.get("REPLICA_CHECK_SECONDS", "1"))
+REPLICA_MAX_LAG_SECONDS = float(os.environ.get("REPLICA_MAX_LAG_SECONDS", "5"))
+REPLICA_PIN_SECONDS = int(os.environ.get("REPLICA_PIN_SECONDS", "30"))
+REPLICA_LAG = Gauge("rifa_replica_lag_seconds", "Atraso de la réplica de lectura", multiprocess_mode="livemax")
+REPLICA_LAG_VERSIONS = Gauge("rifa_replica_lag_versions", "Versiones que le faltan a la réplica (suma de las rifas)", multiprocess_mode="livemax")
+DB_READS = Counter("rifa_db_reads_total", "Sesiones de lectura, por base", ["target"])
+_replica = {"checked": 0.0, "healthy": False, "versions": {}, "behind_since": None}
+_replica_lock = threading.Lock()
+
+def meta_versions(eng):
+    # {clave: versión} de todas las rifas ("version", "version:<id>")
+    with eng.connect() as conn:
+        return dict(conn.execute(
+            select(BoardMeta.key, BoardMeta.value).where(BoardMeta.key.like("version%"))
+        ).all())
+
+def replica_status():
+    # Estado de la réplica, releído como mucho cada REPLICA_CHECK_SECONDS. Si
+    # otro hilo lo está releyendo se usa el anterior en vez de esperar.
+    now = time.monotonic()
+    if now - _replica["checked"] < REPLICA_CHECK_SECONDS or not _replica_lock.acquire(blocking=False):
+        return _replica
+    try:
+        _replica["checked"] = now
+        try:
+            primary, replica = meta_versions(engine), meta_versions(read_engine)
+        except OperationalError:
+            app.logger.warning("réplica de lectura: no se pudo comparar versiones", exc_info=True)
+            _replica["healthy"] = False
+            return _replica
+        missing = sum(max(0, v - replica.get(k, 0)) for k, v in primary.items())
+        if missing:
+            _replica["behind_since"] = _replica["behind_since"] or now
+        else:
+            _replica["behind_since"] = None
+        lag = now - _replica["behind_since"] if missing else 0.0
+        _replica["versions"] = replica
+        _replica["healthy"] = lag <= REPLICA_MAX_LAG_SECONDS
+        REPLICA_LAG.set(lag)
+        REPLICA_LAG_VERSIONS.set(missing)
+        return _replica
+    finally:
+        _replica_lock.release()
+
+def pinned_version(board):
+    # Versión de la cookie "wv" ("<rifa>:<versión>") si es de esta rifa
+    raffle_id, _, version = request.cookies.get("wv", "").partition(":")
+    if raffle_id == str(board.id) and version.isdigit():
+        return int(version)
+    return 0
+
+def read_session(board=None, min_version=0):
+    # Sesión para lecturas: la réplica si está sana y tiene al menos
+    # "min_version" (y la versión que este navegador escribió); si no, la primaria
+    if read_engine is engine:
+        return Session()
+    if board is not None and has_request_context():
+        min_version = max(min_version, pinned_version(board))
+    status = replica_status()
+    if status["healthy"] and (board is None or status["versions"].get(board.key("version"), 0) >= min_version):
+        DB_READS.labels("replica").inc()
+        return ReadSession()
+    DB_READS.labels("primary").inc()
+    return Session()
+
+def note_write(board, version):
+    # Las escrituras hechas en un pedido dejan la versión para la cookie "wv"
+    if version and read_engine is not engine and has_request_context():
+        g.write_version = (board.id, version)
+
+app = Flask(__name__)
+
+def bootstrap():
+    # Una vez por deploy, antes de levantar workers (ver gunicorn.conf.py)
+    inserted = init_db()
+    board = default_board()
+    if board.store is not None:
+        board.store.open(initial=lambda: db_rows(board))
+    return inserted
+
+# Compactación de number_events: un hilo por worker, arrancado con el primer
+# pedido, pasa por todas las rifas cada EVENTS_COMPACT_SECONDS. No depende de
+# que haya streams abiertos: con todos los clientes en polling igual se hace.
+_compactor = {"thread": None}
+_compactor_lock = threading.Lock()
+
+def compact_all_events():
+    return sum(compact_events(board) for board in all_boards())
+
+def _compact_loop():
+    while True:
+        try:
+            compact_all_events()
+        except Exception:
+            app.logger.exception("error compactando number_events")
+        time.sleep(EVENTS_COMPACT_SECONDS)
+
+@app.before_request
+def _start_compactor():
+    if _compactor["thread"] is not None:
+        return
+    with _compactor_lock:
+        if _compactor["thread"] is None:
+            _compactor["thread"] = threading.Thread(target=_compact_loop, name="compact-events", daemon=True)
+            _compactor["thread"].start()
+
+# Las rutas de cada rifa son las mismas con el prefijo /r/<slug>; el slug se
+# saca de los argumentos de la vista y queda en g.board. Sin prefijo, la rifa 1.
+@app.url_value_preprocessor
+def _pick_board(endpoint, values):
+    slug = values.pop("slug", None) if values else None
+    g.board = get_board(slug or DEFAULT_RAFFLE_SLUG)
+    if g.board is None:
+        abort(404)
+
+@app.url_defaults
+def _board_slug(endpoint, values):
+    # url_for() dentro de una rifa arma sus links con el mismo prefijo
+    board = g.get("board")
+    if board is not None and board.id != DEFAULT_RAFFLE_ID and "slug" not in values \
+            and app.url_map.is_endpoint_expecting(endpoint, "slug"):
+        values["slug"] = board.slug
+
+# Registrado antes que el resto de los after_request: Flask los corre en orden
+# inverso, así la latencia medida incluye compresión y demás
+@app.before_request
+def _metrics_start():
+    g.t0 = time.perf_counter()
+
+@app.after_request
+def _metrics_observe(resp):
+    route = request.url_rule.rule if request.url_rule else "<sin ruta>"
+    REQUEST_LATENCY.labels(route, request.method).observe(time.perf_counter() - g.get("t0", time.perf_counter()))
+    REQUESTS.labels(route, str(resp.status_code)).inc()
+    REQUEST_DB_TIME.labels(route).observe(g.get("db_time", 0.0))
+    DB_QUERIES.labels(route).inc(g.get("db_queries", 0))
+    return resp
+
+# Depuración: con la cookie "debug" (ver /admin-debug) o el header X-Debug
+# ("sql" o "profile") un admin ve el resumen en Server-Timing; el detalle de
+# las consultas (y el .pstats del perfil) queda guardado en DEBUG_DIR, que se
+# recorta a los DEBUG_MAX_FILES más nuevos. El perfil (caro) pide siempre
+# X-Admin-Key: la cookie is_admin sola no alcanza.
+def debug_mode():
+    mode = request.headers.get("X-Debug") or request.cookies.get("debug")
+    if mode not in ("sql", "profile"):
+        return None
+    if check_admin_key(request.headers.get("X-Admin-Key", "")):
+        return mode
+    if mode == "sql" and request.cookies.get("is_admin") == "1":
+        return mode
+    return None
+
+@contextlib.contextmanager
+def server_timing(name):
+    # Mide un paso del pedido para Server-Timing; sin modo debug no hace nada
+    if g.get("debug_mode") is None:
+        yield
+        return
+    t0 = time.perf_counter()
+    try:
+        yield
+    finally:
+        g.timings.append((name, time.perf_counter() - t0))
+
+@app.before_request
+def _debug_start():
+    mode = debug_mode()
+    if mode is None:
+        return
+    g.debug_mode = mode
+    g.sql_trace = []
+    g.timings = []
+    if mode == "profile":
+        g.profiler = cProfile.Profile()
+        g.profiler.enable()
+
+@app.after_request
+def _debug_finish(resp):
+    mode = g.get("debug_mode")
+    if mode is None:
+        return resp
+    total = time.perf_counter() - g.t0
+    trace = g.sql_trace
+    stamp = f"{datetime.datetime.now().strftime('%Y%m%d_%H%M%S_%f')}-{request.endpoint or 'none'}"
+    os.makedirs(DEBUG_DIR, exist_ok=True)
+    if mode == "profile":
+        g.profiler.disable()
+        g.profiler.dump_stats(os.path.join(DEBUG_DIR, stamp + ".pstats"))
+    with open(os.path.join(DEBUG_DIR, stamp + ".sql.json"), "w", encoding="utf-8") as f:
+        json.dump({
+            "path": request.full_path,
+            "total_ms": round(total * 1000, 3),
+            "queries": [{"ms": round(t * 1000, 3), "sql": sql} for sql, t in trace],
+        }, f, ensure_ascii=False, indent=1)
+    sweep_debug_dir()
+
+    entries = [
+        f"total;dur={total * 1000:.2f}",
+        f'db;dur={sum(t for _, t in trace) * 1000:.2f};desc="{len(trace)} consultas"',
+    ]
+    entries += [f"{name};dur={t * 1000:.2f}" for name, t in g.timings]
+    slowest = sorted(trace, key=lambda item: item[1], reverse=True)[:3]
+    for i, (sql, t) in enumerate(slowest, start=1):
+        desc = " ".join(sql.split())[:60].replace('"', "'")
+        entries.append(f'sql{i};dur={t * 1000:.2f};desc="{desc}"')
+    entries.append(f'dump;desc="{stamp}"')
+    resp.headers["Server-Timing"] = ", ".join(entries)
+    return resp
+
+def sweep_debug_dir():
+    # Deja los DEBUG_MAX_FILES volcados más nuevos y borra los vencidos
+    now = time.time()
+    files = []
+    for name in os.listdir(DEBUG_DIR):
+        path = os.path.join(DEBUG_DIR, name)
+        try:
+            files.append((os.path.getmtime(path), path))
+        except FileNotFoundError:
+            pass
+    files.sort(reverse=True)
+    for i, (mtime, path) in enumerate(files):
+        if i >= DEBUG_MAX_FILES or now - mtime > DEBUG_TTL_SECONDS:
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+class BoardCollector:
+    # Valores que se leen al momento del scrape (no dependen de cada worker)
+    def collect(self):
+        free = GaugeMetricFamily("rifa_free_numbers", "Números libres", labels=["rifa"])
+        size = GaugeMetricFamily("rifa_board_size", "Números del tablero", labels=["rifa"])
+        version = GaugeMetricFamily("rifa_board_version", "Versión del tablero", labels=["rifa"])
+        for board in all_boards():
+            snap = state_snapshot(board)
+            free.add_metric([board.slug], snap["free"])
+            size.add_metric([board.slug], board.size)
+            version.add_metric([board.slug], snap["version"])
+        yield free
+        yield size
+        yield version
+
+board_registry = CollectorRegistry()
+board_registry.register(BoardCollector())
+
+# --- Página principal: templates compilados una vez, CSS/JS con huella ---
+STATIC_MAX_AGE = 365 * 24 * 3600
+
+def _file_hash(filename):
+    with open(os.path.join(app.static_folder, filename), "rb") as f:
+        return hashlib.sha256(f.read()).hexdigest()[:12]
+
+ASSET_HASHES = {name: _file_hash(name) for name in ("app.css", "app.js")}
+ASSETS_TAG = hashlib.sha256("".join(sorted(ASSET_HASHES.values())).encode()).hexdigest()[:8]
+
+def static_url(filename):
+    # La huella en ?v= cambia con el contenido, así el archivo se puede cachear "para siempre"
+    return url_for("static", filename=filename, v=ASSET_HASHES.get(filename, ASSETS_TAG))
+
+app.jinja_env.globals["static_url"] = static_url
+INDEX_TEMPLATE = app.jinja_env.get_template("index.html")
+GRID_TEMPLATE = app.jinja_env.get_template("_grid.html")
+
+# La grilla solo cambia con la versión del tablero: se renderiza una vez por
+# versión (cache en board.grid)
+def grid_html(board, snap):
+    cached = board.grid
+    if cached["version"] != snap["version"]:
+        cached = {"version": snap["version"], "html": GRID_TEMPLATE.render(numbers=snap["data"])}
+        board.grid = cached
+    return cached["html"]
+
+# --- Compresión gzip/brotli de HTML, JSON, CSS y JS ---
+COMPACT_MIMETYPE = "application/vnd.rifa.compact+json"
+COMPRESS_TYPES = {"text/html", "application/json", COMPACT_MIMETYPE, "text/css", "text/javascript", "application/javascript"}
+COMPRESS_MIN_BYTES = 500
+COMPRESS_CACHE_SIZE = int(os.environ.get("COMPRESS_CACHE_SIZE", "256"))
+_compressed = collections.OrderedDict()     # (etag, encoding) -> bytes, acotado; los ETags llevan board.tag
+
+def compress_response(resp):
+    if resp.status_code != 200 or resp.mimetype not in COMPRESS_TYPES or "Content-Encoding" in resp.headers:
+        return resp
+    accept = request.headers.get("Accept-Encoding", "")
+    if brotli is not None and "br" in accept:
+        encoding = "br"
+    elif "gzip" in accept:
+        encoding = "gzip"
+    else:
+        return resp
+    resp.vary.add("Accept-Encoding")
+    resp.direct_passthrough = False
+    data = resp.get_data()
+    if len(data) < COMPRESS_MIN_BYTES:
+        return resp
+    etag, _ = resp.get_etag()
+    key = (etag, encoding) if etag else None
+    body = _compressed.get(key) if key else None
+    if body is None:
+        body = brotli.compress(data, quality=5) if encoding == "br" else gzip.compress(data, 6)
+        if key:
+            _compressed[key] = body
+            if len(_compressed) > COMPRESS_CACHE_SIZE:
+                _compressed.popitem(last=False)
+    resp.set_data(body)
+    resp.headers["Content-Encoding"] = encoding
+    if etag:
+        # Misma entidad, otra codificación: ETag débil (If-None-Match compara en modo débil)
+        resp.set_etag(etag, weak=True)
+    return resp
+
+@app.after_request
+def cache_and_compress(resp):
+    if request.endpoint == "static" and request.args.get("v"):
+        resp.cache_control.no_cache = None
+        resp.cache_control.public = True
+        resp.cache_control.max_age = STATIC_MAX_AGE
+        resp.cache_control.immutable = True
+    return compress_response(resp)
+
+# --- Límite de pedidos por cliente (token bucket por IP y grupo de rutas) ---
+# Cada cliente tiene un balde de "ráfaga" fichas que se recarga a "tasa" fichas
+# por segundo; cada pedido gasta una y sin fichas la respuesta es 429 con
+# Retry-After. Es por worker y en memoria: los baldes viven en un dict LRU de
+# tamaño fijo, así una avalancha de IPs distintas no hace crecer la memoria.
+# Formato de RATE_LIMIT_*: "tasa,ráfaga" (ej. "2,10"); "0" lo desactiva.
+def parse_rate(value):
+    try:
+        rate, _, burst = value.partition(",")
+        rate, burst = float(rate), float(burst or rate)
+    except ValueError:
+        return None
+    return (rate, max(burst, 1.0)) if rate > 0 else None
+
+RATE_LIMITS = {
+    "pick": parse_rate(os.environ.get("RATE_LIMIT_PICK", "2,10")),
+    "state": parse_rate(os.environ.get("RATE_LIMIT_STATE", "5,30")),
+    "page": parse_rate(os.environ.get("RATE_LIMIT_PAGE", "1,10")),
+}
+RATE_LIMIT_GROUPS = {"pick": "pick", "pick_many": "pick", "api_state": "state", "index": "page"}
+RATE_LIMIT_CLIENTS = int(os.environ.get("RATE_LIMIT_CLIENTS", "10000"))
+# Saltos de proxy delante de la app (Render, nginx): la IP del cliente es la
+# que agregó el último proxy en X-Forwarded-For. 0 (por defecto) = usar la IP
+# de la conexión: sin proxy el X-Forwarded-For lo escribe el propio cliente y
+# cambiándolo en cada pedido tendría siempre un balde nuevo. En Render (un
+# proxy delante) poner PROXY_HOPS=1; si no, todos comparten la IP del proxy.
+PROXY_HOPS = int(os.environ.get("PROXY_HOPS", "0"))
+proxy_warned = threading.Event()
+
+class RateLimiter:
+    def __init__(self, max_clients):
+        self.max_clients = max_clients
+        self.buckets = collections.OrderedDict()    # (grupo, ip) -> [fichas, último pedido]
+        self.lock = threading.Lock()
+
+    def hit(self, key, rate, burst):
+        # 0 si el pedido pasa; si no, los segundos hasta la próxima ficha
+        now = time.monotonic()
+        with self.lock:
+            bucket = self.buckets.get(key)
+            if bucket is None:
+                bucket = self.buckets[key] = [burst, now]
+                if len(self.buckets) > self.max_clients:
+                    self.buckets.popitem(last=False)
+            else:
+                self.buckets.move_to_end(key)
+                bucket[0] = min(burst, bucket[0] + (now - bucket[1]) * rate)
+                bucket[1] = now
+            if bucket[0] >= 1:
+                bucket[0] -= 1
+                return 0
+            return (1 - bucket[0]) / rate
+
+rate_limiter = RateLimiter(RATE_LIMIT_CLIENTS)
+RATE_LIMITED = Counter("rifa_rate_limited_total", "Pedidos rechazados con 429 por el límite por cliente", ["group"])
+
+def client_ip():
+    forwarded = [ip.strip() for ip in request.headers.get("X-Forwarded-For", "").split(",") if ip.strip()]
+    if PROXY_HOPS and len(forwarded) >= PROXY_HOPS:
+        return forwarded[-PROXY_HOPS]
+    if forwarded and not PROXY_HOPS and not proxy_warned.is_set():
+        proxy_warned.set()
+        app.logger.warning("llegó X-Forwarded-For con PROXY_HOPS=0: se usa la IP de la conexión; detrás de un proxy configurar PROXY_HOPS")
+    return request.remote_addr or ""
+
+@app.before_request
+def _rate_limit():
+    group = RATE_LIMIT_GROUPS.get(request.endpoint)
+    limit = RATE_LIMITS.get(group)
+    if limit is None:
+        return None
+    wait = rate_limiter.hit((group, client_ip()), *limit)
+    if not wait:
+        return None
+    RATE_LIMITED.labels(group).inc()
+    retry = max(1, math.ceil(wait))
+    if group == "page":
+        resp = app.response_class("Demasiados pedidos, probá de nuevo en unos segundos.", 429, mimetype="text/plain")
+    else:
+        resp = jsonify({"error": "DEMASIADOS_PEDIDOS", "retry_after": retry})
+        resp.status_code = 429
+    resp.headers["Retry-After"] = str(retry)
+    return resp
+
+# Picks idénticos (misma rifa, números, nombre y cliente) que llegan juntos,
+# ej. un doble toque, comparten un solo intento contra la base: el primero
+# reserva y los que llegan mientras tanto esperan y reciben el mismo
+# resultado. Apenas termina se olvida: un pedido posterior vuelve a intentar,
+# porque el tablero pudo cambiar (ej. un admin liberó el número).
+PICK_COALESCE_WAIT = 10         # espera máxima por el resultado del primero
+
+class PickCoalescer:
+    def __init__(self):
+        self.entries = {}       # clave -> {"done", "result", "error"}, solo los que están en curso
+        self.lock = threading.Lock()
+
+    def run(self, key, attempt):
+        # Devuelve (resultado, compartido)
+        with self.lock:
+            entry = self.entries.get(key)
+            owner = entry is None
+            if owner:
+                entry = self.entries[key] = {"done": threading.Event(), "result": None, "error": None}
+        if not owner:
+            if entry["done"].wait(PICK_COALESCE_WAIT):
+                if entry["error"] is not None:
+                    raise entry["error"]
+                return entry["result"], True
+            return attempt(), False     # el primero sigue trabado: intentar por separado
+        try:
+            entry["result"] = attempt()
+        except BaseException as e:
+            entry["error"] = e
+            raise
+        finally:
+            with self.lock:
+                del self.entries[key]
+            entry["done"].set()
+        return entry["result"], False
+
+pick_coalescer = PickCoalescer()
+
+def claim_coalesced(board, ids, name, atomic=True):
+    key = (board.id, tuple(ids), name, atomic, client_ip())
+    result, shared = pick_coalescer.run(key, lambda: claim_numbers(board, ids, name, atomic))
+    if shared:
+        PICKS.labels("coalesced").inc(len(ids))
+    return result
+
+
+@app.get("/")
+@app.get("/r/<slug>/")
+def index():
+    board = g.board
+    snap = state_snapshot(board)
+    show_admin = (
+        (request.args.get("admin", "") == ADMIN_VIEW_KEY and ADMIN_VIEW_KEY != "")
+        or (request.cookies.get("is_admin") == "1")
+    )
+    err = request.args.get("err") == "noname"
+    error_msg = "Escribí tu nombre para poder elegir." if err else ""
+    with server_timing("grid"):
+        grid = "" if board.virtual else grid_html(board, snap)
+    with server_timing("tpl"):
+        html = render_template(
+            INDEX_TEMPLATE,
+            grid_html=grid,
+            virtual_grid=board.virtual,
+            board_size=board.size,
+            num_width=board.width,
+            first_num=board.fmt(0),
+            last_num=board.fmt(board.size - 1),
+            free_count=snap["free"],
             show_admin=show_admin,
-            raffle_title=RAFFLE_TITLE,
-            raffle_price=RAFFLE_PRICE,
-            raffle_date=RAFFLE_DATE,
-            bank_info=BANK_INFO,
+            base_path=url_for("index").rstrip("/"),
+            raffle_title=board.title,
+            raffle_price=board.price,
+            raffle_date=board.date,
+            bank_info=board.bank_info,
             error_msg=error_msg
         )
-    finally:
-        s.close()
+    resp = app.response_class(html, mimetype="text/html")
+    resp.set_etag(f"{board.tag}i{snap['version']}-{int(show_admin)}{int(err)}-{board.settings_tag}-{ASSETS_TAG}")
+    resp.headers["Cache-Control"] = "no-cache"
+    return resp.make_conditional(request)
 
 @app.post("/pick/<num>")
+@app.post("/r/<slug>/pick/<num>")
 def pick(num):
     name = (request.form.get("name") or "").strip()
-    if not (len(num)==2 and num.isdigit()):
+    idx = g.board.parse(num)
+    if idx is None:
         return redirect(url_for("index"))
     if not name:
         if request.headers.get("X-Requested-With") == "XMLHttpRequest":
             return ("NOMBRE_REQUERIDO", 400)
         return redirect(url_for("index", err="noname"))
 
-    idx = int(num)
-    with lock:
-        s = Session()
-        try:
-            row = s.get(NumberPick, idx)
-            if row and not row.taken:
-                row.taken = True
-                row.name = name[:80]
-                row.updated_at = datetime.datetime.utcnow()
-                s.commit()
-        except OperationalError:
-            s.rollback()
-            if request.headers.get("X-Requested-With") == "XMLHttpRequest":
-                return ("ERROR_DB", 500)
-        finally:
-            s.close()
+    is_xhr = request.headers.get("X-Requested-With") == "XMLHttpRequest"
+    try:
+        claimed, _, _, _ = claim_coalesced(g.board, [idx], name[:80])
+    except STORE_ERRORS:
+        if is_xhr:
+            return ("ERROR_DB", 500)
+        return redirect(url_for("index"))
 
-    if request.headers.get("X-Requested-With") == "XMLHttpRequest":
-        return ("OK", 200)
+    if is_xhr:
+        return ("OK", 200) if claimed else ("OCUPADO", 409)
     return redirect(url_for("index"))
 
+# Compra de varios números en un solo pedido y una sola transacción.
+# Body JSON {"nums": ["05", "17"], "name": "...", "mode": "all"|"partial"}
+# (o form con nums separados por coma). "all" = todo o nada (por defecto),
+# "partial" = reserva los que estén libres e informa el resultado por número.
+PICK_BATCH_MAX = int(os.environ.get("PICK_BATCH_MAX", "50"))
+
+@app.post("/pick")
+@app.post("/r/<slug>/pick")
+def pick_many():
+    board = g.board
+    data = request.get_json(silent=True) or request.form
+    if not isinstance(data, dict):
+        return jsonify({"error": "FORMATO_INVALIDO"}), 400
+    nums = data.get("nums") or []
+    name = data.get("name") or ""
+    mode = data.get("mode") or "all"
+    if isinstance(nums, str):
+        nums = [n for n in nums.replace(" ", ",").split(",") if n]
+    if not isinstance(nums, list) or not isinstance(name, str) or mode not in ("all", "partial"):
+        return jsonify({"error": "FORMATO_INVALIDO"}), 400
+    name = name.strip()[:80]
+    if not name:
+        return jsonify({"error": "NOMBRE_REQUERIDO"}), 400
+    # Cada número como texto ("07"); cualquier otra cosa lo invalida
+    parsed = [board.parse(n) if isinstance(n, str) else None for n in nums]
+    if not parsed or None in parsed or len(set(parsed)) > PICK_BATCH_MAX:
+        return jsonify({"error": "NUMEROS_INVALIDOS", "max": PICK_BATCH_MAX}), 400
+    ids = sorted(set(parsed))
+    try:
+        claimed, busy, version, free = claim_coalesced(board, ids, name, atomic=(mode == "all"))
+    except STORE_ERRORS:
+        return jsonify({"error": "ERROR_DB"}), 500
+    # En modo "all" fallido los libres quedan "no_reservado" (se deshizo todo)
+    results = {
+        board.fmt(i): "ok" if i in claimed else "ocupado" if i in busy else "no_reservado"
+        for i in ids
+    }
+    body = {"ok": bool(claimed), "version": version, "free": free, "name": name, "results": results}
+    return jsonify(body), (200 if claimed else 409)
+
 @app.post("/release/<num>")
+@app.post("/r/<slug>/release/<num>")
 def release(num):
     key = request.form.get("key") or ""
     if key != os.environ.get("ADMIN_KEY",""):
         return ("No autorizado", 401)
-    if not (len(num)==2 and num.isdigit()):
+    idx = g.board.parse(num)
+    if idx is None:
         return redirect(url_for("index"))
-    idx = int(num)
-    with lock:
-        s = Session()
-        try:
-            row = s.get(NumberPick, idx)
-            if row:
-                row.taken = False
-                row.name = ""
-                row.updated_at = datetime.datetime.utcnow()
-                s.commit()
-        finally:
-            s.close()
+    release_number(g.board, idx)
     return redirect(url_for("index"))
 
 @app.post("/reset")
+@app.post("/r/<slug>/reset")
 def reset():
     key = request.form.get("key") or ""
     if key != os.environ.get("ADMIN_KEY",""):
         return ("No autorizado", 401)
-    with lock:
-        s = Session()
-        try:
-            for i in range(100):
-                row = s.get(NumberPick, i)
-                if row:
-                    row.taken = False
-                    row.name = ""
-                    row.updated_at = datetime.datetime.utcnow()
-            s.commit()
-        finally:
-            s.close()
+    try:
+        spans = parse_num_spec(g.board, request.form.get("nums") or "")
+    except ValueError as e:
+        return (str(e), 400)
+    reset_numbers(g.board, spans)
     return redirect(url_for("index"))
 
+def check_admin_key(key):
+    return bool(key) and key == os.environ.get("ADMIN_KEY", "")
+
+# --- Reinicio y alta masiva (para scripts/paneles: responden JSON) ---
+@app.post("/api/admin/reset")
+@app.post("/r/<slug>/api/admin/reset")
+def api_admin_reset():
+    if not check_admin_key(request.form.get("key") or request.headers.get("X-Admin-Key", "")):
+        return ("No autorizado", 401)
+    try:
+        spans = parse_num_spec(g.board, request.form.get("nums") or "")
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    count, version = reset_numbers(g.board, spans)
+    return jsonify({"reset": count, "version": version})
+
+@app.post("/api/admin/seed")
+@app.post("/r/<slug>/api/admin/seed")
+def api_admin_seed():
+    if not check_admin_key(request.form.get("key") or request.headers.get("X-Admin-Key", "")):
+        return ("No autorizado", 401)
+    return jsonify({"inserted": seed_numbers(g.board), "size": g.board.size})
+
+@app.post("/api/admin/poll-interval")
+def api_admin_poll_interval():
+    if not check_admin_key(request.form.get("key") or request.headers.get("X-Admin-Key", "")):
+        return ("No autorizado", 401)
+    seconds = request.form.get("seconds", "")
+    if not seconds.isdigit():
+        return jsonify({"error": "seconds tiene que ser un entero (0 = default)"}), 400
+    return jsonify({"poll_interval": set_poll_interval(seconds)})
+
+@app.after_request
+def pin_reads_to_primary(resp):
+    # Lee lo que acaba de escribir: ver "Réplica de lectura"
+    written = g.get("write_version")
+    if written is not None:
+        resp.set_cookie("wv", "%d:%d" % written, max_age=REPLICA_PIN_SECONDS, httponly=True, samesite="Lax")
+    return resp
+
+@app.after_request
+def add_poll_hint(resp):
+    # También en los 304: es lo que más reciben los navegadores que hacen polling
+    if request.endpoint == "api_state":
+        resp.headers["X-Poll-Interval"] = str(poll_interval())
+    return resp
+
 @app.get("/api/state")
+@app.get("/r/<slug>/api/state")
 def api_state():
-    s = Session()
-    try:
-        data = [
-            {"num": f"{n.id:02d}", "taken": n.taken, "name": n.name}
-            for n in s.query(NumberPick).order_by(NumberPick.id.asc()).all()
+    board = g.board
+    since = request.args.get("since", "")
+    if since.isdigit():
+        # Delta: solo las celdas que cambiaron después de "since"
+        s = read_session(board, int(since))
+        try:
+            version, rows = changes_since(board, s, int(since))
+            if rows is None:
+                return jsonify({"version": version, "resync": True})
+            latest = {}
+            for seq, num, taken, name in rows:
+                latest[num] = {"num": board.fmt(num), "taken": taken, "name": name}
+            out = {"version": version, "changes": [latest[n] for n in sorted(latest)]}
+            if rows:
+                out["free"] = free_count(board, s)
+            return jsonify(out)
+        finally:
+            s.close()
+
+    if request.args.get("from", "").isdigit() or request.args.get("to", "").isdigit():
+        return api_state_range(board)
+
+    snap = state_snapshot(board)
+    if request.args.get("fmt") == "compact" or COMPACT_MIMETYPE in request.headers.get("Accept", ""):
+        resp = app.response_class(snap["compact_body"], mimetype=COMPACT_MIMETYPE)
+        resp.set_etag(f"{board.tag}c{snap['version']}")
+    else:
+        resp = app.response_class(snap["body"], mimetype="application/json")
+        resp.set_etag(f"{board.tag}v{snap['version']}")
+    resp.vary.add("Accept")
+    resp.headers["X-Board-Version"] = str(snap["version"])
+    # El navegador revalida siempre; si nada cambió responde 304 sin cuerpo
+    resp.headers["Cache-Control"] = "no-cache"
+    return resp.make_conditional(request)
+
+def api_state_range(board):
+    # /api/state?from=&to= (inclusive): solo los ocupados del rango, como {num: nombre}
+    snap = state_snapshot(board)
+    start = min(int(request.args.get("from") or 0), board.size - 1)
+    end = min(int(request.args.get("to") or board.size - 1), board.size - 1)
+    taken = {
+        item["num"]: item["name"]
+        for item in snap["data"][start:end + 1]
+        if item["taken"]
+    }
+    resp = jsonify({
+        "version": snap["version"],
+        "size": board.size,
+        "free": snap["free"],
+        "from": start,
+        "to": end,
+        "taken": taken,
+    })
+    resp.set_etag(f"{board.tag}r{snap['version']}-{start}-{end}")
+    resp.headers["Cache-Control"] = "no-cache"
+    return resp.make_conditional(request)
+
+def _sse(event, data, event_id=None):
+    out = f"id: {event_id}\n" if event_id is not None else ""
+    return out + f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False, separators=(',', ':'))}\n\n"
+
+@app.get("/api/stream")
+@app.get("/r/<slug>/api/stream")
+def api_stream():
+    board = g.board
+    feed = board.feed
+    last = request.headers.get("Last-Event-ID") or request.args.get("last") or ""
+    since = int(last) if last.isdigit() else None
+    with stream_slots_lock:
+        if STREAM_MAX_OPEN and stream_slots["open"] >= STREAM_MAX_OPEN:
+            return Response("STREAMS_LLENOS", 503, {"Retry-After": "60"})
+        stream_slots["open"] += 1
+    feed.start()
+
+    def generate(since):
+        yield "retry: 3000\n\n"
+        deadline = time.monotonic() + STREAM_MAX_SECONDS
+        while time.monotonic() < deadline:
+            version, events, resync = feed.wait(since, STREAM_HEARTBEAT_SECONDS)
+            if resync:
+                # El feed no tiene historial tan viejo: probar con number_events
+                # y, si ya se compactó, mandar el estado completo
+                rows = None
+                if since is not None:
+                    s = read_session(board, since)
+                    try:
+                        version, rows = changes_since(board, s, since)
+                        free = free_count(board, s) if rows else None
+                    finally:
+                        s.close()
+                if rows is not None:
+                    for seq, num, taken, name in rows:
+                        yield _sse("cell", {"num": board.fmt(num), "taken": taken, "name": name, "version": seq, "free": free}, seq)
+                    since = version
+                else:
+                    snap = state_snapshot(board)
+                    yield _sse("state", snap["compact"], snap["version"])
+                    since = snap["version"]
+            elif events:
+                for ev in events:
+                    yield _sse("cell", ev, ev["version"])
+                since = version
+            else:
+                yield ": ping\n\n"
+        # Al cortar, EventSource reconecta solo y retoma con Last-Event-ID
+
+    def release_slot():
+        with stream_slots_lock:
+            stream_slots["open"] -= 1
+
+    resp = Response(generate(since), mimetype="text/event-stream")
+    resp.headers["Cache-Control"] = "no-cache"
+    resp.headers["X-Accel-Buffering"] = "no"
+    resp.call_on_close(release_slot)
+    return resp
+
+# --- Exportaciones (xlsx y csv) ---
+# Se generan con openpyxl en modo write-only leyendo las filas en tandas, en
+# un pool de hilos acotado (ver "Trabajos de exportación" más abajo).
+XLSX_MIMETYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+EXPORTS = {
+    "todos":    {"sheet": "Rifa {first}-{last}", "filename": "rifa", "width": 20},
+    "ocupados": {"sheet": "Participantes", "filename": "rifa_ocupados", "width": 22},
+}
+EXPORT_FORMATS = ("xlsx", "csv")
+
+def is_admin_request():
+    key = request.args.get("key") or request.form.get("key") or request.headers.get("X-Admin-Key", "")
+    is_admin_cookie = (request.cookies.get("is_admin") == "1")
+    return is_admin_cookie or check_admin_key(key)
+
+def with_progress(rows, total, progress):
+    # Cada 500 filas avisa el avance y cede el procesador: con workers gevent
+    # el hilo de la exportación es un greenlet y sin esto frenaría al resto
+    for i, row in enumerate(rows, 1):
+        yield row
+        if i % 500 == 0:
+            if progress is not None:
+                progress(i, total)
+            time.sleep(0)
+
+def export_parts(board, kind, s, progress=None):
+    # Devuelve (intro, encabezado, filas, pie). "pie" es una función porque
+    # los totales se conocen recién después de recorrer las filas.
+    intro = [[board.title], [board.price, board.date]]
+    if board.bank_info:
+        intro.append([f"Datos bancarios: {board.bank_info}"])
+    if kind == "todos":
+        intro.append([])
+        header = ["Número", "Estado", "Nombre", "Actualizado"]
+        rows = (
+            [board.fmt(id_), "Ocupado" if taken else "Libre", name, updated_at.strftime("%Y-%m-%d %H:%M:%S")]
+            for id_, taken, name, updated_at in board_rows(board, s)
+        )
+        return intro, header, with_progress(rows, board.size, progress), lambda: []
+
+    intro.append([f"Precio por número (valor numérico): {board.price_value}"])
+    intro.append([])
+    header = ["#", "Número", "Nombre", "Fecha/Hora (UTC)"]
+    count = 0
+
+    def rows():
+        nonlocal count
+        for id_, _, name, updated_at in board_rows(board, s, taken_only=True):
+            count += 1
+            yield [count, board.fmt(id_), name, updated_at.strftime("%Y-%m-%d %H:%M:%S")]
+
+    def footer():
+        return [
+            [],
+            ["Total ocupados", count],
+            ["Precio por número", board.price_value],
+            ["Total recaudado", count * board.price_value],
         ]
-        return jsonify(data)
+    total = board.size - free_count(board, s)
+    return intro, header, with_progress(rows(), total, progress), footer
+
+def build_xlsx(board, kind, s, progress=None):
+    intro, header, rows, footer = export_parts(board, kind, s, progress)
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(EXPORTS[kind]["sheet"].format(first=board.fmt(0), last=board.fmt(board.size - 1)))
+    for col in ["A","B","C","D"]:
+        ws.column_dimensions[col].width = EXPORTS[kind]["width"]
+    for line in intro:
+        ws.append(line)
+    ws.append(header)
+    for r in rows:
+        ws.append(r)
+    for line in footer():
+        ws.append(line)
+    bio = io.BytesIO()
+    wb.save(bio)
+    return bio.getvalue()
+
+def build_csv(board, kind, s, progress=None):
+    # Solo la tabla (y los totales): para abrir en cualquier planilla o script
+    _, header, rows, footer = export_parts(board, kind, s, progress)
+    out = io.StringIO()
+    w = csv.writer(out)
+    w.writerow(header)
+    w.writerows(rows)
+    w.writerows(line for line in footer() if line)
+    return out.getvalue().encode("utf-8-sig")
+
+# --- Trabajos de exportación ---
+# POST /api/exports encola el trabajo y responde al toque con su id; el
+# navegador consulta /api/exports/<id> y baja el archivo cuando está listo.
+# El id sale de (rifa, tipo, formato, versión del tablero), así pedidos iguales
+# (de cualquier worker) comparten un solo trabajo: el estado y el archivo
+# viven en EXPORT_DIR y el primero que crea el estado (O_EXCL) lo genera.
+# Los archivos se borran después de EXPORT_TTL_SECONDS.
+EXPORT_DIR = os.environ.get("EXPORT_DIR", os.path.join(tempfile.gettempdir(), "rifa-exports"))
+EXPORT_WORKERS = int(os.environ.get("EXPORT_WORKERS", "2"))
+EXPORT_TTL_SECONDS = int(os.environ.get("EXPORT_TTL_SECONDS", "3600"))
+EXPORT_STALE_SECONDS = 300      # trabajo sin avances (worker caído): se puede reintentar
+EXPORT_WAIT_SECONDS = 120       # espera máxima de las rutas /export*.xlsx|csv
+EXPORT_JOB_RE = re.compile(r"^(r\d+-)?(todos|ocupados)-(xlsx|csv)-v\d+$")
+_export_pool = ThreadPoolExecutor(max_workers=EXPORT_WORKERS, thread_name_prefix="export")
+_export_sweep = {"at": 0.0}
+
+def export_path(job_id, ext="json"):
+    return os.path.join(EXPORT_DIR, f"{job_id}.{ext}")
+
+def read_export_job(job_id, board=None):
+    # Con "board" solo acepta ids válidos de esa rifa (los que vienen en la URL)
+    if board is not None:
+        m = EXPORT_JOB_RE.match(job_id)
+        if not m or (m.group(1) or "") != board.tag:
+            return None
+    try:
+        with open(export_path(job_id), encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return None
+    except ValueError:
+        # Recién creado por otro worker y todavía sin contenido
+        return {"id": job_id, "state": "pending", "progress": 0, "updated": time.time()}
+
+def write_export_job(job, **fields):
+    job.update(fields, updated=time.time())
+    tmp = export_path(job["id"], f"json.{os.getpid()}.tmp")
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(job, f)
+    os.replace(tmp, export_path(job["id"]))
+    return job
+
+def sweep_exports():
+    # Borra archivos vencidos; como mucho una vez por minuto por worker
+    now = time.time()
+    if now - _export_sweep["at"] < 60:
+        return
+    _export_sweep["at"] = now
+    for name in os.listdir(EXPORT_DIR):
+        path = os.path.join(EXPORT_DIR, name)
+        try:
+            if now - os.path.getmtime(path) > EXPORT_TTL_SECONDS:
+                os.remove(path)
+        except FileNotFoundError:
+            pass
+
+def submit_export(board, kind, fmt):
+    # Devuelve el estado del trabajo para la versión actual, encolándolo si hace falta
+    os.makedirs(EXPORT_DIR, exist_ok=True)
+    sweep_exports()
+    s = read_session(board)
+    try:
+        version = current_version(board, s)
     finally:
         s.close()
+    job_id = f"{board.tag}{kind}-{fmt}-v{version}"
+    for _ in range(2):
+        job = read_export_job(job_id)
+        if job is not None:
+            retry = job["state"] == "error" or (
+                job["state"] != "done" and time.time() - job["updated"] > EXPORT_STALE_SECONDS
+            ) or (
+                job["state"] == "done" and not os.path.exists(export_path(job_id, job["fmt"]))
+            )
+            if not retry:
+                return job
+            with contextlib.suppress(FileNotFoundError):
+                os.remove(export_path(job_id))
+        try:
+            fd = os.open(export_path(job_id), os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        except FileExistsError:
+            continue                # otro worker lo tomó recién
+        os.close(fd)
+        job = write_export_job(
+            {"id": job_id, "kind": kind, "fmt": fmt, "version": version, "created": time.time()},
+            state="pending", progress=0,
+        )
+        _export_pool.submit(run_export, board, job)
+        return job
+    return read_export_job(job_id)
 
-# --- Exportar a Excel (.xlsx) general ---
-@app.get("/export.xlsx")
-def export_excel():
-    key = request.args.get("key", "")
-    is_admin_cookie = (request.cookies.get("is_admin") == "1")
-    if not (is_admin_cookie or (key and key == os.environ.get("ADMIN_KEY",""))):
+def run_export(board, job):
+    s = read_session(board, job["version"])
+    try:
+        write_export_job(job, state="running")
+        progress = lambda done, total: write_export_job(job, progress=round(done / max(total, 1), 3))
+        t0 = time.perf_counter()
+        build = build_xlsx if job["fmt"] == "xlsx" else build_csv
+        body = build(board, job["kind"], s, progress)
+        tmp = export_path(job["id"], f"{job['fmt']}.{os.getpid()}.tmp")
+        with open(tmp, "wb") as f:
+            f.write(body)
+        os.replace(tmp, export_path(job["id"], job["fmt"]))
+        EXPORT_BYTES.labels(job["kind"], job["fmt"]).observe(len(body))
+        write_export_job(job, state="done", progress=1, bytes=len(body),
+                         seconds=round(time.perf_counter() - t0, 3))
+    except Exception as e:
+        app.logger.exception("exportación %s falló", job["id"])
+        write_export_job(job, state="error", error=str(e))
+    finally:
+        s.close()
+
+def export_job_json(job):
+    out = {k: job.get(k) for k in ("id", "state", "progress", "version", "bytes", "error")}
+    out["status_url"] = url_for("api_export_status", job_id=job["id"])
+    out["download_url"] = url_for("api_export_download", job_id=job["id"])
+    return out
+
+def send_export_file(board, job):
+    base = EXPORTS[job["kind"]]["filename"] + (f"_{board.slug}" if board.tag else "")
+    fname = f"{base}_{datetime.datetime.now().strftime('%Y%m%d_%H%M')}.{job['fmt']}"
+    return send_file(
+        export_path(job["id"], job["fmt"]),
+        as_attachment=True,
+        download_name=fname,
+        mimetype=XLSX_MIMETYPE if job["fmt"] == "xlsx" else "text/csv"
+    )
+
+def send_export(kind, fmt):
+    # Descarga directa (links viejos, scripts): usa el mismo trabajo y espera
+    # a que termine. La UI usa /api/exports para no tener el pedido colgado.
+    if not is_admin_request():
         return ("No autorizado", 401)
+    with server_timing("export"):
+        job = submit_export(g.board, kind, fmt)
+        deadline = time.monotonic() + EXPORT_WAIT_SECONDS
+        while job["state"] in ("pending", "running") and time.monotonic() < deadline:
+            time.sleep(0.2)
+            job = read_export_job(job["id"]) or job
+    if job["state"] != "done":
+        return (f"Exportación {job['state']}", 503)
+    return send_export_file(g.board, job)
 
-    s = Session()
+@app.post("/api/exports")
+@app.post("/r/<slug>/api/exports")
+def api_export_create():
+    if not is_admin_request():
+        return ("No autorizado", 401)
+    data = request.get_json(silent=True) or request.form
+    kind, fmt = data.get("kind") or "todos", data.get("fmt") or "xlsx"
+    if kind not in EXPORTS or fmt not in EXPORT_FORMATS:
+        return jsonify({"error": "kind: todos|ocupados, fmt: xlsx|csv"}), 400
+    job = submit_export(g.board, kind, fmt)
+    return jsonify(export_job_json(job)), (200 if job["state"] == "done" else 202)
+
+@app.get("/api/exports/<job_id>")
+@app.get("/r/<slug>/api/exports/<job_id>")
+def api_export_status(job_id):
+    if not is_admin_request():
+        return ("No autorizado", 401)
+    job = read_export_job(job_id, g.board)
+    if job is None:
+        return jsonify({"error": "NO_EXISTE"}), 404
+    resp = jsonify(export_job_json(job))
+    resp.headers["Cache-Control"] = "no-store"
+    return resp
+
+@app.get("/api/exports/<job_id>/file")
+@app.get("/r/<slug>/api/exports/<job_id>/file")
+def api_export_download(job_id):
+    if not is_admin_request():
+        return ("No autorizado", 401)
+    job = read_export_job(job_id, g.board)
+    if job is None:
+        return jsonify({"error": "NO_EXISTE"}), 404
+    if job["state"] != "done":
+        return jsonify(export_job_json(job)), 409
+    if not os.path.exists(export_path(job_id, job["fmt"])):
+        return jsonify({"error": "VENCIDO"}), 404
+    return send_export_file(g.board, job)
+
+# --- Participantes: números, cantidad y total por comprador ---
+# /api/participants?q=jua busca por prefijo del nombre normalizado (sin
+# tildes ni mayúsculas) con el índice (raffle_id, name_key); los totales salen
+# de un GROUP BY y los números de una segunda consulta solo para esa página.
+PARTICIPANTS_LIMIT = 100
+PARTICIPANTS_MAX = 1000
+
+def participants(board, s, prefix, limit):
+    # Devuelve ([(nombre, [números], cantidad)], hay_más) ordenado por nombre
+    if board.store is not None:
+        board.store.refresh()
+        groups = {}
+        for id_, taken, name, _ in board.store.rows():
+            key = normalize_name(name) if taken else ""
+            if key and key.startswith(prefix):
+                groups.setdefault(key, (name, []))[1].append(id_)
+        keys = sorted(groups)
+        out = [(groups[k][0], groups[k][1], len(groups[k][1])) for k in keys[:limit]]
+        return out, len(keys) > limit
+    taken = [NumberPick.raffle_id == board.id, NumberPick.taken == True, NumberPick.id < board.size]
+    where = list(taken)
+    if prefix:
+        # Rango en vez de LIKE: lo resuelve el índice en SQLite y en Postgres
+        where += [NumberPick.name_key >= prefix, NumberPick.name_key < prefix[:-1] + chr(ord(prefix[-1]) + 1)]
+    groups = s.execute(
+        select(NumberPick.name_key, func.min(NumberPick.name), func.count())
+        .where(*where)
+        .group_by(NumberPick.name_key)
+        .order_by(NumberPick.name_key)
+        .limit(limit + 1)
+    ).all()
+    more = len(groups) > limit
+    groups = groups[:limit]
+    numbers = collections.defaultdict(list)
+    if groups:
+        for key, id_ in s.execute(
+            select(NumberPick.name_key, NumberPick.id)
+            .where(*taken, NumberPick.name_key.in_([key for key, _, _ in groups]))
+            .order_by(NumberPick.id)
+        ):
+            numbers[key].append(id_)
+    return [(name, numbers[key], count) for key, name, count in groups], more
+
+@app.get("/api/participants")
+@app.get("/r/<slug>/api/participants")
+def api_participants():
+    if not is_admin_request():
+        return ("No autorizado", 401)
+    board = g.board
+    prefix = normalize_name(request.args.get("q", ""))
+    limit = request.args.get("limit", "")
+    limit = min(int(limit), PARTICIPANTS_MAX) if limit.isdigit() and int(limit) > 0 else PARTICIPANTS_LIMIT
+    s = read_session(board)
     try:
-        rows = s.query(NumberPick).order_by(NumberPick.id.asc()).all()
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "Rifa 00-99"
-        ws.append([RAFFLE_TITLE])
-        ws.append([RAFFLE_PRICE, RAFFLE_DATE])
-        if BANK_INFO:
-            ws.append([f"Datos bancarios: {BANK_INFO}"])
-        ws.append([])
-
-        ws.append(["Número", "Estado", "Nombre", "Actualizado"])
-        for r in rows:
-            ws.append([
-                f"{r.id:02d}",
-                "Ocupado" if r.taken else "Libre",
-                r.name,
-                r.updated_at.strftime("%Y-%m-%d %H:%M:%S")
-            ])
-        for col in ["A","B","C","D"]:
-            ws.column_dimensions[col].width = 20
-
-        bio = io.BytesIO()
-        wb.save(bio)
-        bio.seek(0)
-        fname = f"rifa_{datetime.datetime.now().strftime('%Y%m%d_%H%M')}.xlsx"
-        return send_file(
-            bio,
-            as_attachment=True,
-            download_name=fname,
-            mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-        )
+        rows, more = participants(board, s, prefix, limit)
     finally:
         s.close()
+    resp = jsonify({
+        "q": prefix,
+        "price": board.price_value,
+        "more": more,
+        "participants": [
+            {"name": name, "numbers": [board.fmt(i) for i in ids], "count": count, "total": count * board.price_value}
+            for name, ids, count in rows
+        ],
+    })
+    resp.headers["Cache-Control"] = "no-store"
+    return resp
+
+# --- Exportar a Excel (.xlsx) general ---
+@app.get("/export.xlsx")
+@app.get("/r/<slug>/export.xlsx")
+def export_excel():
+    return send_export("todos", "xlsx")
+
+@app.get("/export.csv")
+@app.get("/r/<slug>/export.csv")
+def export_csv():
+    return send_export("todos", "csv")
 
 # --- Exportar SOLO ocupados + total recaudado ---
 @app.get("/export-ocupados.xlsx")
+@app.get("/r/<slug>/export-ocupados.xlsx")
 def export_occupied_excel():
-    key = request.args.get("key", "")
-    is_admin_cookie = (request.cookies.get("is_admin") == "1")
-    if not (is_admin_cookie or (key and key == os.environ.get("ADMIN_KEY",""))):
-        return ("No autorizado", 401)
-
-    s = Session()
-    try:
-        rows = s.query(NumberPick).filter(NumberPick.taken == True).order_by(NumberPick.id.asc()).all()
-        count = len(rows)
-        total = count * PRICE_PER_NUMBER
-
-        wb = Workbook()
-        ws = wb.active
-        ws.title = "Participantes"
-
-        ws.append([RAFFLE_TITLE])
-        ws.append([RAFFLE_PRICE, RAFFLE_DATE])
-        if BANK_INFO:
-            ws.append([f"Datos bancarios: {BANK_INFO}"])
-        ws.append([f"Precio por número (valor numérico): {PRICE_PER_NUMBER}"])
-        ws.append([])
-
-        ws.append(["#", "Número", "Nombre", "Fecha/Hora (UTC)"])
-        for i, r in enumerate(rows, start=1):
-            ws.append([
-                i,
-                f"{r.id:02d}",
-                r.name,
-                r.updated_at.strftime("%Y-%m-%d %H:%M:%S")
-            ])
+    return send_export("ocupados", "xlsx")
 
-        ws.append([])
-        ws.append(["Total ocupados", count])
-        ws.append(["Precio por número", PRICE_PER_NUMBER])
-        ws.append(["Total recaudado", total])
-
-        for col in ["A","B","C","D","E"]:
-            if col in ws.column_dimensions:
-                ws.column_dimensions[col].width = 22
-
-        bio = io.BytesIO()
-        wb.save(bio)
-        bio.seek(0)
-        fname = f"rifa_ocupados_{datetime.datetime.now().strftime('%Y%m%d_%H%M')}.xlsx"
-        return send_file(
-            bio,
-            as_attachment=True,
-            download_name=fname,
-            mimetype="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-        )
-    finally:
-        s.close()
+@app.get("/export-ocupados.csv")
+@app.get("/r/<slug>/export-ocupados.csv")
+def export_occupied_csv():
+    return send_export("ocupados", "csv")
 
 # --- Login/Logout de panel admin por cookie ---
 @app.get("/admin-login")
+@app.get("/r/<slug>/admin-login")
 def admin_login():
     key = request.args.get("key", "")
     resp = redirect(url_for("index"))
@@ -539,13 +2025,132 @@ def admin_login():
         resp.set_cookie("is_admin", "1", max_age=86400, secure=True, httponly=True, samesite="Lax")
     return resp
 
+# Activa/desactiva la depuración por pedido para este navegador (solo admins)
+@app.get("/admin-debug")
+@app.get("/r/<slug>/admin-debug")
+def admin_debug():
+    if request.cookies.get("is_admin") != "1":
+        return ("No autorizado", 401)
+    mode = request.args.get("mode", "off")
+    resp = redirect(url_for("index"))
+    if mode == "sql":       # el perfil va por pedido con X-Debug y X-Admin-Key
+        resp.set_cookie("debug", mode, max_age=3600, secure=True, httponly=True, samesite="Lax")
+    else:
+        resp.delete_cookie("debug")
+    return resp
+
 @app.get("/admin-logout")
+@app.get("/r/<slug>/admin-logout")
 def admin_logout():
     resp = redirect(url_for("index"))
     resp.delete_cookie("is_admin")
     return resp
 
+# --- Métricas Prometheus (admin: cookie, ?key= o "Authorization: Bearer <ADMIN_KEY>") ---
+@app.get("/metrics")
+def metrics():
+    auth = request.headers.get("Authorization", "")
+    if not (is_admin_request() or check_admin_key(auth.removeprefix("Bearer ").strip())):
+        return ("No autorizado", 401)
+    if "PROMETHEUS_MULTIPROC_DIR" in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+    else:
+        registry = REGISTRY
+    body = generate_latest(registry) + generate_latest(board_registry)
+    return Response(body, mimetype=CONTENT_TYPE_LATEST.split(";")[0], headers={"Cache-Control": "no-store"})
+
+# --- Mantenimiento ---
+RAFFLE_OPTION = click.option("--raffle", default="", help="Slug de la rifa (vacío = la principal).")
+
+@app.cli.command("compact-events")
+def compact_events_command():
+    """Borra el historial de number_events más viejo que EVENTS_KEEP versiones."""
+    print(f"Eventos borrados: {compact_all_events()}")
+
+@app.cli.command("reset-board")
+@click.option("--nums", default="", help='Números a liberar, ej. "01,05,10-20" (vacío = todos).')
+@RAFFLE_OPTION
+def reset_board_command(nums, raffle):
+    """Libera los números ocupados con un solo UPDATE."""
+    board = board_option(raffle)
+    try:
+        spans = parse_num_spec(board, nums)
+    except ValueError as e:
+        raise click.BadParameter(str(e), param_hint="--nums")
+    count, version = reset_numbers(board, spans)
+    print(f"Números liberados: {count} (versión {version})")
+
+@app.cli.command("seed-board")
+@RAFFLE_OPTION
+def seed_board_command(raffle):
+    """Crea las filas que falten en el tablero de la rifa."""
+    board = board_option(raffle)
+    print(f"Números creados: {seed_numbers(board)} (tablero de {board.size})")
+
+@app.cli.command("raffle-create")
+@click.argument("slug")
+@click.option("--title", required=True)
+@click.option("--price", default="", help="Premios.")
+@click.option("--date", default="", help="Fecha o condiciones del sorteo.")
+@click.option("--price-value", type=float, default=10.0, help="Precio por número.")
+@click.option("--bank-info", default="")
+@click.option("--size", type=click.IntRange(10, 10000), default=100, help="Números del tablero.")
+def raffle_create_command(slug, title, price, date, price_value, bank_info, size):
+    """Crea una rifa nueva, servida en /r/<slug>/."""
+    if not SLUG_RE.match(slug) or slug == DEFAULT_RAFFLE_SLUG:
+        raise click.BadParameter("minúsculas, números y guiones (hasta 40), distinto de la principal", param_hint="SLUG")
+    s = WriteSession()
+    try:
+        if s.execute(select(Raffle.id).where(Raffle.slug == slug)).first():
+            raise click.UsageError(f"Ya existe la rifa {slug}")
+        raffle = Raffle(slug=slug, title=title, price=price, date=date,
+                        price_value=price_value, bank_info=bank_info.strip(), size=size)
+        s.add(raffle)
+        s.flush()
+        seed_numbers(raffle, s)
+        s.execute(insert_ignore(BoardMeta), [
+            {"key": meta_key(raffle.id, key), "value": 0} for key in ("version", "events_floor")
+        ])
+        s.commit()
+        print(f"Rifa {raffle.id} creada en /r/{slug}/ ({size} números)")
+    finally:
+        s.close()
+
+@app.cli.command("raffle-list")
+def raffle_list_command():
+    """Lista las rifas con sus números libres."""
+    for board in all_boards():
+        snap = state_snapshot(board)
+        print(f"{board.id:>4}  /r/{board.slug}/  {snap['free']}/{board.size} libres  v{snap['version']}  {board.title}")
+
+@app.cli.command("poll-interval")
+@click.argument("seconds", type=int)
+def poll_interval_command(seconds):
+    """Fija el intervalo de polling sugerido a los clientes (0 = default)."""
+    print(f"Intervalo de polling: {set_poll_interval(seconds)} s")
+
+@app.cli.command("journal-snapshot")
+@RAFFLE_OPTION
+def journal_snapshot_command(raffle):
+    """Guarda un snapshot del tablero y arranca un journal nuevo (BOARD_STORE=journal)."""
+    board = board_option(raffle)
+    if board.store is None:
+        raise click.UsageError("BOARD_STORE no es journal")
+    print(f"Snapshot en la versión {board.store.snapshot()} ({board.store.path})")
+
+# Importar la app no toca la base: la primera conexión la abre el primer pedido
+STARTUP_SECONDS.set(time.perf_counter() - STARTUP_T0)
+
+@app.cli.command("bootstrap")
+def bootstrap_command():
+    """Crea las tablas y siembra el tablero (idempotente, se puede correr siempre)."""
+    t0 = time.perf_counter()
+    inserted = bootstrap()
+    print(f"Base lista en {(time.perf_counter() - t0) * 1000:.0f} ms: {inserted} números creados (tablero de {BOARD_SIZE})")
+
 if __name__ == "__main__":
+    bootstrap()
     app.run(host="0.0.0.0", port=int(os.environ.get("PORT", 5000)))
 
 
@@ -0,0 +1,308 @@
+"""Benchmark de carga para los caminos calientes de la rifa.
+
+Levanta la app en un proceso aparte (servidor threaded de werkzeug) contra un
+SQLite temporal, o contra --database-url (ej. un Postgres local), y simula:
+
+  * N "espectadores" que consultan /api/state (revalidando con ETag como el
+    navegador) y cada tanto recargan /
+  * M compradores que compiten por los mismos números con POST /pick/<num>
+
+Reporta throughput, latencias p50/p95/p99 por ruta, consultas SQL por pedido
+y la cantidad de números vendidos dos veces (tiene que ser 0). El resultado
+se guarda en JSON para comparar corridas:
+
+    python bench.py --pollers 50 --pickers 20 --duration 15 --out antes.json
+    python bench.py --pollers 50 --pickers 20 --duration 15 --compare antes.json
+
+Con --url se apunta a un servidor ya levantado (ej. gunicorn); en ese caso no
+se cuentan las consultas SQL.
+"""
+import argparse, collections, datetime, http.client, json, multiprocessing, os, random
+import socket, subprocess, sys, tempfile, threading, time, urllib.parse
+
+ENDPOINTS = ["index", "api_state", "pick"]
+
+
+def serve(port, database_url, board_size, counters, ready):
+    # Proceso hijo: app + contadores de consultas por endpoint en memoria compartida
+    os.environ["DATABASE_URL"] = database_url
+    os.environ["BOARD_SIZE"] = str(board_size)
+    os.environ.setdefault("ADMIN_KEY", "bench")
+    for limit in ("RATE_LIMIT_PICK", "RATE_LIMIT_STATE", "RATE_LIMIT_PAGE"):
+        os.environ.setdefault(limit, "0")      # todo sale de la misma IP: sin límite por cliente
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    import logging
+    from flask import g, request
+    from sqlalchemy import event
+    from werkzeug.serving import make_server
+    import app as rifa
+
+    logging.getLogger("werkzeug").setLevel(logging.ERROR)
+    rifa.bootstrap()
+    rifa.reset_numbers(rifa.default_board())
+
+    @event.listens_for(rifa.engine, "before_cursor_execute")
+    def count_query(*args):
+        try:
+            g.bench_queries = g.get("bench_queries", 0) + 1
+        except RuntimeError:    # consulta fuera de un pedido (hilo del feed)
+            pass
+
+    @rifa.app.after_request
+    def count_request(resp):
+        if request.endpoint in ENDPOINTS:
+            i = ENDPOINTS.index(request.endpoint) * 2
+            with counters.get_lock():
+                counters[i] += 1
+                counters[i + 1] += g.get("bench_queries", 0)
+        return resp
+
+    server = make_server("127.0.0.1", port, rifa.app, threaded=True)
+    ready.set()
+    server.serve_forever()
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def wait_port(host, port, timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection((host, port), 0.5).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise SystemExit(f"El servidor no respondió en {host}:{port}")
+
+
+class Client:
+    # Conexión keep-alive por hilo; reconecta si el servidor la cierra
+    def __init__(self, host, port):
+        self.host, self.port = host, port
+        self.conn = None
+
+    def request(self, method, path, body=None, headers=None):
+        for attempt in (0, 1):
+            if self.conn is None:
+                self.conn = http.client.HTTPConnection(self.host, self.port, timeout=30)
+            try:
+                self.conn.request(method, path, body=body, headers=headers or {})
+                resp = self.conn.getresponse()
+                data = resp.read()
+                if resp.getheader("Connection", "").lower() == "close":
+                    self.conn.close()
+                    self.conn = None
+                return resp.status, resp.getheader("ETag"), data
+            except (http.client.HTTPException, OSError):
+                self.conn.close()
+                self.conn = None
+                if attempt:
+                    raise
+
+
+class Stats:
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.latencies = collections.defaultdict(list)
+        self.status = collections.defaultdict(collections.Counter)
+
+    def record(self, endpoint, seconds, status):
+        with self.lock:
+            self.latencies[endpoint].append(seconds * 1000)
+            self.status[endpoint][status] += 1
+
+
+def percentile(values, p):
+    if not values:
+        return None
+    values = sorted(values)
+    k = min(len(values) - 1, max(0, round(p / 100 * len(values)) - 1))
+    return round(values[k], 3)
+
+
+def poller(client, stats, stop, index_ratio, interval):
+    etag = None
+    while not stop.is_set():
+        start = time.perf_counter()
+        try:
+            if random.random() < index_ratio:
+                endpoint = "index"
+                status, _, _ = client.request("GET", "/")
+            else:
+                endpoint = "api_state"
+                headers = {"If-None-Match": etag} if etag else {}
+                status, new_etag, _ = client.request("GET", "/api/state", headers=headers)
+                etag = new_etag or etag
+        except Exception:
+            status = "error"
+        stats.record(endpoint, time.perf_counter() - start, status)
+        if interval:
+            stop.wait(interval)
+
+
+def picker(client, stats, stop, worker_id, numbers, winners, winners_lock):
+    # Todos los compradores recorren los mismos números en distinto orden,
+    # así cada número se disputa entre varios hilos a la vez
+    order = list(numbers)
+    random.shuffle(order)
+    name = f"bench-{worker_id}"
+    for num in order:
+        if stop.is_set():
+            return
+        body = urllib.parse.urlencode({"name": name})
+        headers = {
+            "Content-Type": "application/x-www-form-urlencoded",
+            "X-Requested-With": "XMLHttpRequest",
+        }
+        start = time.perf_counter()
+        try:
+            status, _, _ = client.request("POST", f"/pick/{num}", body=body, headers=headers)
+        except Exception:
+            status = "error"
+        stats.record("pick", time.perf_counter() - start, status)
+        if status == 200:
+            with winners_lock:
+                winners[num].append(name)
+
+
+def summarize(stats, elapsed, counters):
+    out = {}
+    for endpoint in ENDPOINTS:
+        lat = stats.latencies.get(endpoint, [])
+        entry = {
+            "requests": len(lat),
+            "rps": round(len(lat) / elapsed, 1),
+            "p50_ms": percentile(lat, 50),
+            "p95_ms": percentile(lat, 95),
+            "p99_ms": percentile(lat, 99),
+            "status": {str(k): v for k, v in stats.status[endpoint].items()},
+        }
+        if counters is not None:
+            served, queries = counters[ENDPOINTS.index(endpoint) * 2: ENDPOINTS.index(endpoint) * 2 + 2]
+            entry["db_queries_per_request"] = round(queries / served, 2) if served else None
+        out[endpoint] = entry
+    return out
+
+
+def compare(current, previous):
+    print(f"\n{'ruta':<10} {'métrica':<24} {'antes':>10} {'ahora':>10} {'cambio':>9}")
+    for endpoint in ENDPOINTS:
+        for metric in ("rps", "p95_ms", "p99_ms", "db_queries_per_request"):
+            old = previous.get("endpoints", {}).get(endpoint, {}).get(metric)
+            new = current["endpoints"][endpoint].get(metric)
+            if old is None or new is None:
+                continue
+            change = f"{(new - old) / old * 100:+.1f}%" if old else "-"
+            print(f"{endpoint:<10} {metric:<24} {old:>10} {new:>10} {change:>9}")
+
+
+def git_revision():
+    try:
+        return subprocess.check_output(
+            ["git", "rev-parse", "--short", "HEAD"],
+            cwd=os.path.dirname(os.path.abspath(__file__)), stderr=subprocess.DEVNULL,
+        ).decode().strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--pollers", type=int, default=50, help="espectadores concurrentes")
+    parser.add_argument("--pickers", type=int, default=20, help="compradores concurrentes")
+    parser.add_argument("--duration", type=float, default=10, help="segundos de prueba")
+    parser.add_argument("--numbers", type=int, default=100, help="números en disputa")
+    parser.add_argument("--board-size", type=int, default=100)
+    parser.add_argument("--index-ratio", type=float, default=0.1, help="fracción de recargas de /")
+    parser.add_argument("--poll-interval", type=float, default=0, help="pausa entre polls (0 = sin pausa)")
+    parser.add_argument("--database-url", default="", help="por defecto un SQLite temporal")
+    parser.add_argument("--url", default="", help="servidor ya levantado (no cuenta consultas SQL)")
+    parser.add_argument("--out", default="", help="archivo JSON de salida")
+    parser.add_argument("--compare", default="", help="JSON de una corrida anterior")
+    args = parser.parse_args(argv)
+
+    counters = None
+    server = None
+    if args.url:
+        target = urllib.parse.urlparse(args.url)
+        host, port = target.hostname, target.port or 80
+        database = None
+    else:
+        database = args.database_url or f"sqlite:///{tempfile.mkdtemp(prefix='rifa-bench-')}/bench.db"
+        host, port = "127.0.0.1", free_port()
+        counters = multiprocessing.Array("q", len(ENDPOINTS) * 2)
+        ready = multiprocessing.Event()
+        server = multiprocessing.Process(
+            target=serve, args=(port, database, args.board_size, counters, ready), daemon=True
+        )
+        server.start()
+        ready.wait(60)
+    wait_port(host, port)
+
+    width = len(str(args.board_size - 1))
+    numbers = [str(i).zfill(width) for i in range(min(args.numbers, args.board_size))]
+    stats = Stats()
+    stop = threading.Event()
+    winners = collections.defaultdict(list)
+    winners_lock = threading.Lock()
+    threads = [
+        threading.Thread(target=poller, args=(Client(host, port), stats, stop, args.index_ratio, args.poll_interval))
+        for _ in range(args.pollers)
+    ] + [
+        threading.Thread(target=picker, args=(Client(host, port), stats, stop, i, numbers, winners, winners_lock))
+        for i in range(args.pickers)
+    ]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    time.sleep(args.duration)
+    stop.set()
+    for t in threads:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    # Verificación: ningún número con dos ganadores y el estado final coincide
+    status, _, body = Client(host, port).request("GET", "/api/state")
+    final = {item["num"]: item for item in json.loads(body)} if status == 200 else {}
+    double_sold = sorted(num for num, names in winners.items() if len(names) > 1)
+    mismatched = sorted(
+        num for num, names in winners.items()
+        if len(names) == 1 and final and final[num]["name"] != names[0]
+    )
+
+    result = {
+        "started_at": datetime.datetime.utcnow().isoformat(timespec="seconds") + "Z",
+        "git_revision": git_revision(),
+        "config": {k: v for k, v in vars(args).items() if k not in ("out", "compare")},
+        "database": (database or "").split("@")[-1] if database else None,
+        "elapsed_s": round(elapsed, 2),
+        "total_rps": round(sum(len(v) for v in stats.latencies.values()) / elapsed, 1),
+        "endpoints": summarize(stats, elapsed, counters),
+        "picks": {
+            "sold": len(winners),
+            "double_sold": len(double_sold),
+            "double_sold_numbers": double_sold,
+            "final_state_mismatch": len(mismatched),
+        },
+    }
+    if server is not None:
+        server.terminate()
+
+    text = json.dumps(result, indent=2, ensure_ascii=False)
+    print(text)
+    out = args.out or f"bench-{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.json"
+    with open(out, "w", encoding="utf-8") as f:
+        f.write(text + "\n")
+    print(f"\nResultado guardado en {out}")
+    if args.compare:
+        with open(args.compare, encoding="utf-8") as f:
+            compare(result, json.load(f))
+    return 1 if double_sold or mismatched else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
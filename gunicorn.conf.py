@@ -0,0 +1,54 @@
+import os, shutil, subprocess, sys, tempfile, time
+
+# Con Postgres, workers gevent: cada conexión (incluidos los streams SSE de
+# /api/stream) es un greenlet, así un worker puede sostener miles de
+# espectadores inactivos. Con SQLite (el default) no: sqlite3 no le cede el
+# control a gevent, así que un BEGIN IMMEDIATE esperando el lock (hasta
+# SQLITE_BUSY_TIMEOUT_MS) congela todo el worker. Ahí van workers gthread:
+# cada pedido, y cada stream abierto, ocupa un hilo, y los streams se limitan
+# a la mitad de los hilos (STREAM_MAX_OPEN) para dejar lugar a los picks; los
+# espectadores de más caen al polling. Forzando gevent con SQLite, app.py
+# acorta el busy timeout (ver SQLITE_GEVENT_BUSY_TIMEOUT_MS).
+# Con GUNICORN_WORKER_CLASS=sync cada stream ocupa un worker entero.
+IS_SQLITE = os.environ.get("DATABASE_URL", "sqlite").startswith("sqlite")
+worker_class = os.environ.get("GUNICORN_WORKER_CLASS", "gthread" if IS_SQLITE else "gevent")
+workers = int(os.environ.get("WEB_CONCURRENCY", "2"))
+threads = int(os.environ.get("GUNICORN_THREADS", "64"))
+if worker_class == "gthread":
+    os.environ.setdefault("STREAM_MAX_OPEN", str(threads // 2))
+worker_connections = int(os.environ.get("GUNICORN_WORKER_CONNECTIONS", "2000"))
+timeout = int(os.environ.get("GUNICORN_TIMEOUT", "30"))
+keepalive = 75
+bind = "0.0.0.0:" + os.environ.get("PORT", "8000")
+
+# Métricas de prometheus_client compartidas entre workers (ver /metrics en app.py).
+# Se define acá, antes de que los workers importen la app.
+os.environ.setdefault("PROMETHEUS_MULTIPROC_DIR", os.path.join(tempfile.gettempdir(), "rifa-metrics"))
+# Importado acá (después de fijar el directorio, prometheus_client lo lee al
+# importarse) y no dentro de child_exit: importarlo en medio del manejo de
+# señales del master al apagar fallaba con un import circular.
+from prometheus_client import multiprocess
+
+def on_starting(server):
+    # Arrancar con el directorio vacío: los archivos viejos sumarían valores de otra corrida
+    metrics_dir = os.environ["PROMETHEUS_MULTIPROC_DIR"]
+    shutil.rmtree(metrics_dir, ignore_errors=True)
+    os.makedirs(metrics_dir, exist_ok=True)
+    # Esquema y siembra una sola vez, antes de los workers. En otro proceso para
+    # no importar la app en el master (los workers heredarían conexiones abiertas).
+    if os.environ.get("SKIP_BOOTSTRAP") != "1":
+        env = {k: v for k, v in os.environ.items() if k != "PROMETHEUS_MULTIPROC_DIR"}
+        subprocess.run(
+            [sys.executable, "-m", "flask", "--app", "app", "bootstrap"],
+            check=True, env=env, cwd=os.path.dirname(os.path.abspath(__file__)),
+        )
+
+# Tiempo de arranque de cada worker: del fork a tener la app cargada
+def post_fork(server, worker):
+    worker.boot_t0 = time.monotonic()
+
+def post_worker_init(worker):
+    worker.log.info("Worker %s listo en %.0f ms", worker.pid, (time.monotonic() - worker.boot_t0) * 1000)
+
+def child_exit(server, worker):
+    multiprocess.mark_process_dead(worker.pid)
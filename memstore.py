@@ -0,0 +1,308 @@
+"""Tablero en memoria con journal en disco (BOARD_STORE=journal en app.py).
+
+Cada worker tiene el tablero entero en memoria (bitmap de ocupados + nombres)
+y atiende las lecturas sin tocar la base. Las escrituras se agregan a un
+journal (una línea JSON por versión, con fsync) bajo un lock de archivo
+exclusivo, así varios workers de gunicorn nunca venden el mismo número: antes
+de decidir, el que escribe lee lo que agregaron los demás. Las lecturas solo
+hacen un stat() del journal y, si creció, leen la cola.
+
+Cada SNAPSHOT_EVERY versiones el estado completo se guarda en snapshot.json y
+el journal arranca de nuevo. Al levantar se carga el snapshot y se reaplica el
+journal; una línea cortada por un corte de luz se descarta.
+
+    <dir>/board.lock      lock entre procesos (flock)
+    <dir>/snapshot.json   {"v", "size", "names": {num: nombre}, "updated": {num: epoch}}
+    <dir>/journal.log     {"v": versión, "t": epoch, "c": [[num, ocupado, nombre], ...]}
+"""
+import collections, datetime, fcntl, json, os, threading, time
+
+
+class JournalBoard:
+    def __init__(self, path, size, history=10000, snapshot_every=5000, fsync=True):
+        self.path = path
+        self.size = size
+        self.snapshot_every = snapshot_every
+        self.fsync = fsync
+        self.lock = threading.Lock()
+        self.history = collections.deque(maxlen=history)   # (versión, [(num, ocupado, nombre)])
+        self.pid = None
+        self.journal_fd = None
+        self.lock_fd = None
+
+    # --- Archivos ---
+    def _file(self, name):
+        return os.path.join(self.path, name)
+
+    def _open_files(self):
+        # Después de un fork hay que reabrir: flock se comparte entre procesos
+        # que heredan el mismo descriptor y dejaría de excluir
+        for fd in (self.journal_fd, self.lock_fd):
+            if fd is not None:
+                os.close(fd)
+        self.lock_fd = os.open(self._file("board.lock"), os.O_RDWR | os.O_CREAT, 0o644)
+        self.journal_fd = os.open(self._file("journal.log"), os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+        self.ino = os.fstat(self.journal_fd).st_ino
+        self.offset = 0
+        self.pid = os.getpid()
+
+    def _ensure_files(self):
+        # True si hubo que reabrir (primer uso en este proceso)
+        if self.pid != os.getpid():
+            self._open_files()
+            return True
+        return False
+
+    def _flock(self, mode):
+        fcntl.flock(self.lock_fd, mode)
+
+    def _fsync_dir(self):
+        fd = os.open(self.path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    # --- Carga ---
+    def open(self, initial=None):
+        # initial(): filas (num, ocupado, nombre, actualizado) para arrancar
+        # un journal vacío, ej. el contenido actual de la base
+        os.makedirs(self.path, exist_ok=True)
+        with self.lock:
+            self._open_files()
+            self._flock(fcntl.LOCK_EX)
+            try:
+                fresh = not os.path.exists(self._file("snapshot.json")) and os.fstat(self.journal_fd).st_size == 0
+                if fresh and initial is not None:
+                    self._reset_memory(0)
+                    for num, taken, name, updated in initial():
+                        if num < self.size and taken:
+                            self._set(num, True, name, updated.replace(tzinfo=datetime.timezone.utc).timestamp())
+                    self._write_snapshot()
+                self._load()
+                if os.fstat(self.journal_fd).st_size > self.offset:
+                    # Línea a medias de un corte: se descarta para no pegarle la próxima
+                    os.ftruncate(self.journal_fd, self.offset)
+            finally:
+                self._flock(fcntl.LOCK_UN)
+        return self
+
+    def _reset_memory(self, version):
+        self.version = version
+        self.taken = bytearray(self.size)
+        self.names = [""] * self.size
+        self.updated = [0.0] * self.size
+        self.free = self.size
+        self.history.clear()
+        self.base = version                # hay historial desde esta versión
+        self.since_snapshot = 0
+        self.created = time.time()         # "actualizado" de los que nunca cambiaron
+
+    def _load(self):
+        # Snapshot + journal completo. Con el lock tomado (compartido o exclusivo).
+        version = 0
+        snap = None
+        if os.path.exists(self._file("snapshot.json")):
+            with open(self._file("snapshot.json"), encoding="utf-8") as f:
+                snap = json.load(f)
+            version = snap["v"]
+        self._reset_memory(version)
+        if snap:
+            for num, name in snap["names"].items():
+                if int(num) < self.size:
+                    self._set(int(num), True, name, snap["updated"].get(num, 0.0))
+        self.ino = os.fstat(self.journal_fd).st_ino
+        self.offset = 0
+        self._read_tail()
+
+    def _read_tail(self):
+        # Aplica las líneas completas agregadas después de self.offset
+        size = os.fstat(self.journal_fd).st_size
+        if size <= self.offset:
+            return
+        data = os.pread(self.journal_fd, size - self.offset, self.offset)
+        end = data.rfind(b"\n") + 1
+        for line in data[:end].splitlines():
+            try:
+                rec = json.loads(line)
+            except ValueError:
+                continue                    # basura de un corte a mitad de escritura
+            if rec["v"] > self.version:    # las ya incluidas en el snapshot se saltean
+                self._apply(rec)
+        self.offset += end
+
+    def _apply(self, rec):
+        for num, taken, name in rec["c"]:
+            if num < self.size:
+                self._set(num, bool(taken), name, rec["t"])
+        self.version = rec["v"]
+        self.history.append((rec["v"], [(num, bool(taken), name) for num, taken, name in rec["c"]]))
+        if len(self.history) == self.history.maxlen:
+            self.base = self.history[0][0] - 1
+        self.since_snapshot += 1
+
+    def _set(self, num, taken, name, updated):
+        if self.taken[num] != taken:
+            self.free += -1 if taken else 1
+        self.taken[num] = taken
+        self.names[num] = name if taken else ""
+        self.updated[num] = updated
+
+    def _catch_up(self):
+        # Con el lock tomado: ponerse al día con lo que escribieron otros workers
+        self._read_tail()
+        try:
+            ino = os.stat(self._file("journal.log")).st_ino
+        except FileNotFoundError:
+            return
+        if ino != self.ino:
+            # Otro worker hizo snapshot y rotó el journal. El journal viejo ya
+            # quedó completo (la rotación se hace con el lock exclusivo), así
+            # que se sigue con el nuevo desde el principio.
+            version = self.version
+            old_fd = self.journal_fd
+            self.journal_fd = os.open(self._file("journal.log"), os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+            os.close(old_fd)
+            self.ino = os.fstat(self.journal_fd).st_ino
+            self.offset = 0
+            with open(self._file("snapshot.json"), encoding="utf-8") as f:
+                snap_version = json.load(f)["v"]
+            if snap_version != version:
+                self._load()
+            else:
+                self._read_tail()
+
+    def refresh(self):
+        # Camino rápido de las lecturas: un stat() y nada más si no hubo cambios
+        if self.pid == os.getpid():
+            try:
+                st = os.stat(self._file("journal.log"))
+            except FileNotFoundError:
+                st = None
+            if st is not None and st.st_ino == self.ino and st.st_size == self.offset:
+                return
+        with self.lock:
+            reopened = self._ensure_files()
+            self._flock(fcntl.LOCK_SH)
+            try:
+                self._load() if reopened else self._catch_up()
+            finally:
+                self._flock(fcntl.LOCK_UN)
+
+    # --- Escrituras ---
+    def _write(self, decide):
+        # decide() corre con el lock exclusivo y el estado al día; devuelve la
+        # lista de cambios (num, ocupado, nombre) a persistir, o [] para nada.
+        # Devuelve (cambios, versión) y los tiempos para las métricas.
+        with self.lock:
+            reopened = self._ensure_files()
+            t0 = time.perf_counter()
+            self._flock(fcntl.LOCK_EX)
+            t_locked = time.perf_counter()
+            try:
+                self._load() if reopened else self._catch_up()
+                changes = decide()
+                if changes:
+                    rec = {"v": self.version + 1, "t": time.time(), "c": [[n, int(t), name] for n, t, name in changes]}
+                    line = (json.dumps(rec, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8")
+                    os.write(self.journal_fd, line)
+                    if self.fsync:
+                        os.fsync(self.journal_fd)
+                    self._apply(rec)
+                    self.offset += len(line)
+                    if self.since_snapshot >= self.snapshot_every:
+                        self._snapshot_locked()
+                return changes, self.version, t0, t_locked
+            finally:
+                self._flock(fcntl.LOCK_UN)
+
+    def claim(self, ids, name, atomic=True):
+        # Devuelve (reservados, ocupados, versión, libres) como claim_numbers
+        result = {}
+
+        def decide():
+            free_ids = [i for i in ids if not self.taken[i]]
+            result["busy"] = sorted(set(ids) - set(free_ids))
+            if not free_ids or (atomic and result["busy"]):
+                return []
+            return [(i, True, name) for i in sorted(free_ids)]
+
+        changes, version, t0, t_locked = self._write(decide)
+        claimed = [num for num, _, _ in changes]
+        if not claimed:
+            return [], result["busy"], None, None, t0, t_locked
+        return claimed, result["busy"], version, self.free, t0, t_locked
+
+    def release(self, ids=None):
+        # Libera los ocupados de "ids" (None = todos). Devuelve (liberados, versión)
+        def decide():
+            candidates = range(self.size) if ids is None else ids
+            return [(i, False, "") for i in candidates if self.taken[i]]
+
+        changes, version, t0, t_locked = self._write(decide)
+        return len(changes), version, t0, t_locked
+
+    # --- Snapshot ---
+    def _write_snapshot(self):
+        snap = {
+            "v": self.version,
+            "size": self.size,
+            "names": {str(i): self.names[i] for i in range(self.size) if self.taken[i]},
+            "updated": {str(i): self.updated[i] for i in range(self.size) if self.taken[i]},
+        }
+        tmp = self._file("snapshot.json.tmp")
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(snap, f, ensure_ascii=False, separators=(",", ":"))
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, self._file("snapshot.json"))
+        self._fsync_dir()
+
+    def _snapshot_locked(self):
+        # Snapshot y journal nuevo (vacío). Si se corta entre los dos pasos, al
+        # levantar se saltean las líneas del journal viejo ya incluidas.
+        self._write_snapshot()
+        tmp = self._file("journal.log.tmp")
+        os.close(os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o644))
+        os.replace(tmp, self._file("journal.log"))
+        self._fsync_dir()
+        os.close(self.journal_fd)
+        self.journal_fd = os.open(self._file("journal.log"), os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+        self.ino = os.fstat(self.journal_fd).st_ino
+        self.offset = 0
+        self.since_snapshot = 0
+
+    def snapshot(self):
+        with self.lock:
+            reopened = self._ensure_files()
+            self._flock(fcntl.LOCK_EX)
+            try:
+                self._load() if reopened else self._catch_up()
+                self._snapshot_locked()
+                return self.version
+            finally:
+                self._flock(fcntl.LOCK_UN)
+
+    # --- Lecturas (llamar antes a refresh()) ---
+    def changes_since(self, since):
+        # Igual que changes_since() de app.py: (versión, [(seq, num, ocupado, nombre)])
+        # o (versión, None) si no hay historial desde "since"
+        with self.lock:
+            version = self.version
+            if since == version:
+                return version, []
+            if since < self.base or since > version:
+                return version, None
+            return version, [
+                (v, num, taken, name)
+                for v, cells in self.history if v > since
+                for num, taken, name in cells
+            ]
+
+    def rows(self):
+        # (num, ocupado, nombre, actualizado) de todo el tablero, en orden
+        with self.lock:
+            taken, names, updated = bytes(self.taken), list(self.names), list(self.updated)
+            created = self.created
+        for i in range(self.size):
+            yield i, bool(taken[i]), names[i], datetime.datetime.utcfromtimestamp(updated[i] or created)
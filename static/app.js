@@ -0,0 +1,434 @@
+// Prefijo de la rifa ("/r/<slug>"; vacío en la principal) para las llamadas al servidor
+const BASE = document.body.dataset.base || '';
+
+function share(){
+  if (navigator.share){ navigator.share({title:document.title, url: window.location.href}); }
+  else { navigator.clipboard.writeText(window.location.href); alert("Enlace copiado. Pegalo en el grupo de WhatsApp."); }
+}
+
+// Botones de descarga: la exportación se genera en segundo plano
+// (POST /api/exports) y se baja cuando el servidor avisa que está lista.
+// Autoriza la ADMIN_KEY del campo o, en el panel, la cookie de admin.
+function downloadExcel(){ startExport('todos'); }
+function downloadExcelOcupados(){ startExport('ocupados'); }
+async function startExport(kind, fmt='xlsx'){
+  const k = (document.getElementById('adminKeyForDownload') || {}).value || "";
+  const headers = k ? {'X-Admin-Key': k} : {};
+  try{
+    const res = await fetch(BASE + '/api/exports', {method:'POST', headers, body: new URLSearchParams({kind, fmt})});
+    if(res.status === 401){ alert(k ? "Clave incorrecta." : "Ingresá la ADMIN_KEY para descargar."); return; }
+    let job = await res.json();
+    while(job.state === 'pending' || job.state === 'running'){
+      await new Promise(r => setTimeout(r, 1000));
+      job = await (await fetch(job.status_url, {headers, cache:'no-store'})).json();
+    }
+    if(job.state !== 'done'){ alert("No se pudo generar la exportación."); return; }
+    window.location.href = k ? `${job.download_url}?key=${encodeURIComponent(k)}` : job.download_url;
+  }catch(e){
+    alert("No se pudo generar la exportación.");
+  }
+}
+
+// Modal bancario
+function openBankModal(){
+  const m = document.getElementById('bankModal'); if(m){ m.style.display='flex'; }
+}
+function closeBankModal(){
+  const m = document.getElementById('bankModal'); if(m){ m.style.display='none'; }
+}
+async function copyBankInfo(){
+  const el = document.getElementById('bankText');
+  if(!el) return;
+  try{
+    await navigator.clipboard.writeText(el.textContent);
+    alert("Datos bancarios copiados.");
+  }catch(e){
+    // Fallback para navegadores antiguos
+    const ta = document.createElement('textarea');
+    ta.value = el.textContent;
+    document.body.appendChild(ta);
+    ta.select(); document.execCommand('copy');
+    document.body.removeChild(ta);
+    alert("Datos bancarios copiados.");
+  }
+}
+// Abrir modal automáticamente si ?bank=1
+(function(){
+  const params = new URLSearchParams(window.location.search);
+  if(params.get('bank') === '1'){ openBankModal(); }
+})();
+
+// Render helpers
+function renderFreeCell(num){
+  return `
+    <div class="mono"><strong>${num}</strong></div>
+    <button class="pick" type="button" onclick="pickNumber('${num}', this)">Elegir</button>
+  `;
+}
+function renderTakenCell(num, name){
+  return `
+    <div class="mono"><strong>${num}</strong></div>
+    <small>Ocupado por: ${name ? name.replace(/</g,"&lt;").replace(/>/g,"&gt;") : ""}</small>
+  `;
+}
+
+// Selección múltiple: varios números en un solo pedido (POST /pick)
+const selection = new Set();
+let multiSelect = false;
+function toggleMultiSelect(){
+  multiSelect = !multiSelect;
+  if(!multiSelect){
+    for(const num of selection){ markSelected(num, false); }
+    selection.clear();
+  }
+  const btn = document.getElementById('multi-toggle');
+  if(btn){ btn.classList.toggle('active', multiSelect); }
+  updateSelectionBar();
+}
+function markSelected(num, on){
+  const el = document.getElementById('cell-' + num);
+  if(el){ el.classList.toggle('selected', on); }
+}
+function toggleSelect(num){
+  const on = !selection.has(num);
+  if(on){ selection.add(num); } else { selection.delete(num); }
+  markSelected(num, on);
+  updateSelectionBar();
+}
+function updateSelectionBar(){
+  const bar = document.getElementById('selbar');
+  if(!bar) return;
+  bar.hidden = !multiSelect;
+  document.getElementById('sel-list').textContent = [...selection].sort().join(', ') || '—';
+}
+async function confirmSelection(){
+  const nameInput = document.getElementById('nombre');
+  const name = nameInput ? nameInput.value.trim() : "";
+  const nums = [...selection].sort();
+  if(!name){
+    alert("Escribí tu nombre para poder elegir.");
+    if(nameInput) nameInput.focus();
+    return;
+  }
+  if(!nums.length){ alert("Tocá \"Elegir\" en los números que quieras."); return; }
+  if(!confirm(`¿Confirmás elegir los números ${nums.join(', ')} a nombre de "${name}"?`)){
+    return;
+  }
+  try{
+    const res = await fetch(BASE + '/pick', {
+      method:'POST',
+      headers: {'Content-Type':'application/json', 'X-Requested-With':'XMLHttpRequest'},
+      body: JSON.stringify({nums, name, mode:'partial'})
+    });
+    if(res.status === 429){ alert(tooManyRequestsMsg(res)); return; }
+    const data = await res.json();
+    if(!data.results){
+      alert(data.error || "No se pudo completar la reserva.");
+      return;
+    }
+    const busy = [];
+    for(const [num, result] of Object.entries(data.results)){
+      if(result === 'ok'){ applyCell({num, taken:true, name:data.name}); }
+      else { busy.push(num); }
+    }
+    if(data.free !== null){ updateFreeCount(data.free); }
+    toggleMultiSelect();
+    if(busy.length){
+      alert(`Estos números ya estaban ocupados: ${busy.join(', ')}`);
+      if(!streamOpen){ await refreshState(); }
+    }
+  }catch(e){
+    alert("No se pudo completar la reserva. Revisá tu conexión e intentá de nuevo.");
+  }
+}
+
+function tooManyRequestsMsg(res){
+  const secs = parseInt(res.headers.get('Retry-After') || '', 10) || 1;
+  return `Demasiados intentos seguidos. Esperá ${secs} segundo${secs === 1 ? '' : 's'} y probá de nuevo.`;
+}
+
+// Elegir número (validación + confirmación)
+async function pickNumber(num, btn){
+  if(multiSelect){ toggleSelect(num); return; }
+  const nameInput = document.getElementById('nombre');
+  const name = nameInput ? nameInput.value.trim() : "";
+  if(!name){
+    alert("Escribí tu nombre para poder elegir.");
+    if(nameInput) nameInput.focus();
+    return;
+  }
+  if(!confirm(`¿Confirmás elegir el número ${num} a nombre de "${name}"?`)){
+    return;
+  }
+  if(btn){ btn.disabled = true; }
+  try{
+    const fd = new FormData();
+    fd.append('name', name);
+    const res = await fetch(`${BASE}/pick/${num}`, {
+      method:'POST',
+      headers: {'X-Requested-With':'XMLHttpRequest'},
+      body: fd
+    });
+    if(res.status === 429){
+      alert(tooManyRequestsMsg(res));
+      return;
+    }
+    if(res.status === 409){
+      alert(`El número ${num} ya fue elegido por otra persona.`);
+      if(!streamOpen){ await refreshState(); }
+      return;
+    }
+    if(!res.ok){
+      const txt = await res.text();
+      alert(txt || "No se pudo completar la reserva.");
+      return;
+    }
+    if(!streamOpen){ await refreshState(); }
+  }catch(e){
+    alert("No se pudo completar la reserva. Revisá tu conexión e intentá de nuevo.");
+  }finally{
+    if(btn){ btn.disabled = false; }
+  }
+}
+
+// Tablero: en modo virtual (tableros grandes) el estado vive en memoria y
+// solo se dibujan en el DOM las filas visibles
+const gridEl = document.getElementById('grid');
+const BOARD = {
+  size: parseInt(gridEl.dataset.size, 10),
+  width: parseInt(gridEl.dataset.width, 10),
+  virtual: gridEl.dataset.virtual === '1',
+  cols: 10,
+  rowH: 64,           // alto de .grid.virtual .cell + gap (ver app.css)
+  page: 500,          // celdas por pedido a /api/state?from=&to=
+  taken: null,
+  names: null,
+  loaded: new Set(),
+  loading: new Set(),
+};
+function fmtNum(i){ return String(i).padStart(BOARD.width, '0'); }
+
+// Aplicar el estado de una celda (modelo + DOM si está dibujada)
+function applyCell(item){
+  if(item.taken && selection.has(item.num)){
+    selection.delete(item.num);
+    markSelected(item.num, false);
+    updateSelectionBar();
+  }
+  if(BOARD.virtual){
+    const i = parseInt(item.num, 10);
+    BOARD.taken[i] = item.taken ? 1 : 0;
+    BOARD.names[i] = item.taken ? (item.name || "") : "";
+  }
+  const el = document.getElementById('cell-' + item.num);
+  if(!el) return;
+  const prevTaken = el.getAttribute('data-taken') === '1';
+  if(item.taken){
+    el.classList.remove('free'); el.classList.add('taken');
+    el.setAttribute('data-taken','1');
+    el.setAttribute('data-name', item.name || "");
+    if(!prevTaken){ el.innerHTML = renderTakenCell(item.num, item.name || ""); }
+  }else{
+    el.classList.remove('taken'); el.classList.add('free');
+    el.setAttribute('data-taken','0');
+    el.setAttribute('data-name','');
+    if(prevTaken){ el.innerHTML = renderFreeCell(item.num); }
+  }
+}
+// Estado completo en formato compacto (bitmap base64 + nombres de los ocupados)
+function applyCompact(data){
+  const bits = atob(data.bits);
+  for(let i = 0; i < data.size; i++){
+    const taken = (bits.charCodeAt(i >> 3) >> (i & 7)) & 1;
+    applyCell({num: fmtNum(i), taken: taken === 1, name: taken ? (data.names[i] || "") : ""});
+  }
+  if(BOARD.virtual){
+    for(let p = 0; p * BOARD.page < BOARD.size; p++){ BOARD.loaded.add(p); }
+    queueRender();
+  }
+  updateFreeCount(data.free);
+}
+
+// El servidor manda "free" con cada cambio; si no viene (grilla completa) se cuenta el DOM
+function updateFreeCount(free){
+  const fc = document.getElementById('free-count');
+  if(!fc) return;
+  if(free === undefined || free === null){
+    if(BOARD.virtual) return;
+    free = document.querySelectorAll('#grid .cell[data-taken="0"]').length;
+  }
+  fc.textContent = free.toString();
+}
+
+// --- Grilla virtual ---
+function renderCell(i){
+  const num = fmtNum(i);
+  if(!BOARD.loaded.has(Math.floor(i / BOARD.page))){
+    return `<div class="cell loading" id="cell-${num}"><div class="mono"><strong>${num}</strong></div></div>`;
+  }
+  const taken = BOARD.taken[i] === 1;
+  const sel = selection.has(num) ? ' selected' : '';
+  return `<div class="cell ${taken ? 'taken' : 'free'}${sel}" id="cell-${num}" data-num="${num}" data-taken="${taken ? 1 : 0}">`
+    + (taken ? renderTakenCell(num, BOARD.names[i]) : renderFreeCell(num)) + `</div>`;
+}
+let renderQueued = false;
+function renderWindow(){
+  renderQueued = false;
+  const vp = document.getElementById('grid-viewport');
+  const rows = Math.ceil(BOARD.size / BOARD.cols);
+  const first = Math.max(0, Math.floor(vp.scrollTop / BOARD.rowH) - 4);
+  const last = Math.min(rows, Math.ceil((vp.scrollTop + vp.clientHeight) / BOARD.rowH) + 4);
+  const from = first * BOARD.cols, to = Math.min(BOARD.size, last * BOARD.cols);
+  const html = [];
+  for(let i = from; i < to; i++){ html.push(renderCell(i)); }
+  gridEl.style.transform = `translateY(${first * BOARD.rowH}px)`;
+  gridEl.innerHTML = html.join('');
+  for(let p = Math.floor(from / BOARD.page); p * BOARD.page < to; p++){ loadPage(p); }
+}
+function queueRender(){
+  if(!renderQueued){ renderQueued = true; requestAnimationFrame(renderWindow); }
+}
+async function loadPage(p){
+  if(BOARD.loaded.has(p) || BOARD.loading.has(p)) return;
+  BOARD.loading.add(p);
+  try{
+    const from = p * BOARD.page, to = Math.min(BOARD.size, from + BOARD.page) - 1;
+    const res = await fetch(`${BASE}/api/state?from=${from}&to=${to}`, {cache:'no-cache'});
+    if(!res.ok) return;
+    const data = await res.json();
+    for(let i = from; i <= to; i++){ BOARD.taken[i] = 0; BOARD.names[i] = ""; }
+    for(const [num, name] of Object.entries(data.taken)){
+      const i = parseInt(num, 10);
+      BOARD.taken[i] = 1; BOARD.names[i] = name;
+    }
+    BOARD.loaded.add(p);
+    if(stateVersion === null){ stateVersion = data.version; }
+    updateFreeCount(data.free);
+    queueRender();
+  }catch(e){
+  }finally{
+    BOARD.loading.delete(p);
+  }
+}
+function goToNumber(){
+  const input = document.getElementById('goto-num');
+  const i = parseInt((input && input.value) || '', 10);
+  if(isNaN(i) || i < 0 || i >= BOARD.size) return;
+  document.getElementById('grid-viewport').scrollTop = Math.floor(i / BOARD.cols) * BOARD.rowH;
+}
+if(BOARD.virtual){
+  BOARD.taken = new Uint8Array(BOARD.size);
+  BOARD.names = new Array(BOARD.size).fill("");
+  document.getElementById('grid-spacer').style.height = `${Math.ceil(BOARD.size / BOARD.cols) * BOARD.rowH}px`;
+  document.getElementById('grid-viewport').addEventListener('scroll', queueRender, {passive:true});
+  window.addEventListener('resize', queueRender);
+  renderWindow();
+}
+
+// Polling: pide solo los cambios desde la última versión vista y recarga el
+// estado completo (con ETag) cuando el servidor pide resync.
+// Devuelve true si algo cambió.
+let stateEtag = null;
+let stateVersion = null;
+async function refreshState(){
+  try{
+    if(stateVersion !== null){
+      const res = await fetch(`${BASE}/api/state?since=${stateVersion}`, {cache:'no-store'});
+      readPollHint(res);
+      if(!res.ok) return false;
+      const delta = await res.json();
+      if(!delta.resync){
+        for(const item of delta.changes){ applyCell(item); }
+        if(delta.changes.length){ updateFreeCount(delta.free); }
+        stateVersion = delta.version;
+        return delta.changes.length > 0;
+      }
+    }
+    if(BOARD.virtual){
+      // Resync en modo virtual: volver a pedir solo las páginas visibles
+      BOARD.loaded.clear();
+      stateVersion = null;
+      queueRender();
+      return true;
+    }
+    const res = await fetch(BASE + '/api/state?fmt=compact', {cache:'no-cache'});
+    readPollHint(res);
+    if(!res.ok) return false;
+    stateVersion = parseInt(res.headers.get('X-Board-Version') || '0', 10);
+    const etag = res.headers.get('ETag');
+    if(etag && etag === stateEtag) return false;
+    stateEtag = etag;
+    applyCompact(await res.json());
+    return true;
+  }catch(e){ return false; }
+}
+
+// Intervalo adaptativo: el servidor sugiere la base (X-Poll-Interval, o
+// Retry-After si está saturado); mientras no cambia nada se espera cada vez
+// más (x1.5, hasta 6 veces la base) y con la pestaña oculta no se pide nada.
+const POLL = {base: 5, idle: 0, retryAfter: 0, maxFactor: 6};
+let pollTimer = null;
+let polling = false;
+function readPollHint(res){
+  const hint = parseInt(res.headers.get('X-Poll-Interval') || '', 10);
+  if(hint > 0){ POLL.base = hint; }
+  const retry = parseInt(res.headers.get('Retry-After') || '', 10);
+  POLL.retryAfter = (res.status === 429 || res.status === 503) && retry > 0 ? retry : 0;
+}
+function nextPollDelay(){
+  const factor = Math.min(Math.pow(1.5, POLL.idle), POLL.maxFactor);
+  return Math.max(POLL.base * factor, POLL.retryAfter) * 1000;
+}
+async function pollTick(){
+  pollTimer = null;
+  if(!polling || document.hidden) return;
+  const changed = await refreshState();
+  POLL.idle = changed ? 0 : POLL.idle + 1;
+  if(polling && !document.hidden && !pollTimer){ pollTimer = setTimeout(pollTick, nextPollDelay()); }
+}
+function startPolling(){
+  if(polling) return;
+  polling = true;
+  POLL.idle = 0;
+  pollTick();
+}
+function stopPolling(){
+  polling = false;
+  if(pollTimer){ clearTimeout(pollTimer); pollTimer = null; }
+}
+document.addEventListener('visibilitychange', () => {
+  if(!polling) return;
+  if(document.hidden){
+    if(pollTimer){ clearTimeout(pollTimer); pollTimer = null; }
+  }else if(!pollTimer){
+    // Al volver a la pestaña: refrescar ya y empezar de nuevo desde la base
+    POLL.idle = 0;
+    pollTick();
+  }
+});
+
+// Cambios en vivo por SSE; si el stream no se puede abrir, volvemos al polling
+let streamOpen = false;
+function startStream(){
+  if(!window.EventSource){ startPolling(); return; }
+  let opened = false;
+  const es = new EventSource(BASE + '/api/stream');
+  es.onopen = () => { opened = true; streamOpen = true; stopPolling(); };
+  es.addEventListener('state', (e) => {
+    const data = JSON.parse(e.data);
+    applyCompact(data);
+    stateVersion = data.v;
+  });
+  es.addEventListener('cell', (e) => {
+    const item = JSON.parse(e.data);
+    applyCell(item);
+    stateVersion = item.version;
+    updateFreeCount(item.free);
+  });
+  es.onerror = () => {
+    streamOpen = false;
+    // Si ya estuvo abierto, EventSource reconecta solo y retoma con Last-Event-ID
+    if(!opened || es.readyState === EventSource.CLOSED){ es.close(); startPolling(); }
+  };
+}
+startStream();
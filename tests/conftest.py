@@ -0,0 +1,36 @@
+import os, sys, tempfile
+
+import pytest
+
+# app.py lee la configuración al importarse: base SQLite temporal, tablero de
+# 100 y sin límite por cliente (todos los pedidos del test client son de la misma IP)
+_tmp = tempfile.mkdtemp(prefix="rifa-tests-")
+os.environ.update({
+    "DATABASE_URL": f"sqlite:///{_tmp}/test.db",
+    "ADMIN_KEY": "test",
+    "BOARD_SIZE": "100",
+    "EXPORT_DIR": os.path.join(_tmp, "exports"),
+    "RATE_LIMIT_PICK": "0",
+    "RATE_LIMIT_STATE": "0",
+    "RATE_LIMIT_PAGE": "0",
+})
+for var in ("DATABASE_READ_URL", "BOARD_STORE", "PROMETHEUS_MULTIPROC_DIR"):
+    os.environ.pop(var, None)
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import app as rifa
+
+rifa.bootstrap()
+
+
+@pytest.fixture
+def board():
+    # Cada test arranca con el tablero libre
+    board = rifa.default_board()
+    rifa.reset_numbers(board)
+    return board
+
+
+@pytest.fixture
+def client(board):
+    return rifa.app.test_client()
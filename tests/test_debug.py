@@ -0,0 +1,30 @@
+import os
+
+import pytest
+
+import app as rifa
+
+
+@pytest.fixture
+def debug_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(rifa, "DEBUG_DIR", str(tmp_path))
+    return tmp_path
+
+
+def test_debug_dir_keeps_the_newest_dumps(client, debug_dir, monkeypatch):
+    monkeypatch.setattr(rifa, "DEBUG_MAX_FILES", 3)
+    client.set_cookie("is_admin", "1")
+    for _ in range(5):
+        assert "dump;" in client.get("/api/state", headers={"X-Debug": "sql"}).headers["Server-Timing"]
+    assert len(os.listdir(debug_dir)) == 3
+
+
+def test_profile_needs_the_admin_key(client, debug_dir):
+    client.set_cookie("is_admin", "1")
+    resp = client.get("/api/state", headers={"X-Debug": "profile"})
+    assert "Server-Timing" not in resp.headers
+    assert os.listdir(debug_dir) == []
+
+    resp = client.get("/api/state", headers={"X-Debug": "profile", "X-Admin-Key": "test"})
+    assert "Server-Timing" in resp.headers
+    assert any(name.endswith(".pstats") for name in os.listdir(debug_dir))
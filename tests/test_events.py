@@ -0,0 +1,24 @@
+from sqlalchemy import func, select
+
+import app as rifa
+
+
+def event_count(board):
+    s = rifa.Session()
+    try:
+        return s.execute(select(func.count()).select_from(rifa.NumberEvent).where(rifa.NumberEvent.raffle_id == board.id)).scalar_one()
+    finally:
+        s.close()
+
+
+def test_compactor_starts_without_streams(client):
+    client.get("/api/state")
+    assert rifa._compactor["thread"].is_alive()
+
+
+def test_compaction_keeps_the_last_versions(client, board, monkeypatch):
+    for num in ("01", "02", "03", "04", "05"):
+        client.post("/pick", json={"nums": [num], "name": "Ana"})
+    monkeypatch.setattr(rifa, "EVENTS_KEEP", 2)
+    rifa.compact_all_events()
+    assert event_count(board) == 2
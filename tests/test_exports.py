@@ -0,0 +1,28 @@
+import time
+
+
+def test_admin_panel_uses_the_export_jobs(client):
+    client.set_cookie("is_admin", "1")
+    html = client.get("/").get_data(as_text=True)
+    assert "startExport('ocupados', 'csv')" in html
+    assert "/export.xlsx" not in html and "/export-ocupados.csv" not in html
+
+
+def test_csv_export_job_with_the_admin_cookie(client):
+    client.post("/pick", json={"nums": ["07"], "name": "Ana"})
+    client.set_cookie("is_admin", "1")
+    resp = client.post("/api/exports", data={"kind": "ocupados", "fmt": "csv"})
+    assert resp.status_code in (200, 202)
+    job = resp.get_json()
+    for _ in range(50):
+        if job["state"] == "done":
+            break
+        time.sleep(0.1)
+        job = client.get(job["status_url"]).get_json()
+    assert job["state"] == "done"
+    body = client.get(job["download_url"]).get_data().decode("utf-8-sig")
+    assert "07" in body and "Ana" in body
+
+
+def test_export_jobs_need_admin(client):
+    assert client.post("/api/exports", data={"kind": "todos", "fmt": "csv"}).status_code == 401
@@ -0,0 +1,108 @@
+import multiprocessing
+import os
+import shutil
+
+from memstore import JournalBoard
+
+SIZE = 40
+
+
+def journal(path, **kwargs):
+    kwargs.setdefault("fsync", False)
+    return JournalBoard(str(path), SIZE, **kwargs).open()
+
+
+def taken(board):
+    board.refresh()
+    return {num: name for num, is_taken, name, _ in board.rows() if is_taken}
+
+
+def _race(board, name, barrier, out):
+    barrier.wait()
+    claimed = []
+    for num in range(SIZE):
+        claimed += board.claim([num], name)[0]
+    out.put((name, claimed))
+
+
+def test_forked_workers_never_claim_the_same_number(tmp_path):
+    # Abierto en el padre como en gunicorn: cada hijo tiene que reabrir sus archivos
+    board = journal(tmp_path, snapshot_every=7)
+    ctx = multiprocessing.get_context("fork")
+    barrier, out = ctx.Barrier(2), ctx.Queue()
+    procs = [ctx.Process(target=_race, args=(board, name, barrier, out)) for name in ("ana", "beto")]
+    for p in procs:
+        p.start()
+    results = dict(out.get(timeout=30) for _ in procs)
+    for p in procs:
+        p.join(10)
+        assert p.exitcode == 0
+    assert not set(results["ana"]) & set(results["beto"])
+    assert sorted(results["ana"] + results["beto"]) == list(range(SIZE))
+    final = taken(journal(tmp_path))
+    assert final == {num: name for name, nums in results.items() for num in nums}
+
+
+def test_torn_last_line_is_dropped_and_truncated(tmp_path):
+    board = journal(tmp_path)
+    board.claim([1, 2], "ana")
+    board.claim([3], "beto")
+    log = tmp_path / "journal.log"
+    good = log.stat().st_size
+    with open(log, "ab") as f:
+        f.write(b'{"v":3,"t":1,"c":[[4,1,"ca')
+    reopened = journal(tmp_path)
+    assert taken(reopened) == {1: "ana", 2: "ana", 3: "beto"}
+    assert log.stat().st_size == good
+    reopened.claim([4], "carla")
+    assert taken(journal(tmp_path)) == {1: "ana", 2: "ana", 3: "beto", 4: "carla"}
+
+
+def test_reader_open_across_rotations_sees_the_final_state(tmp_path):
+    writer = journal(tmp_path, snapshot_every=3)
+    reader = journal(tmp_path, snapshot_every=3)
+    writer.claim([0], "ana")
+    assert taken(reader) == {0: "ana"}
+    for num in range(1, 10):
+        writer.claim([num], "beto")
+    writer.release([5])
+    expected = {0: "ana", **{num: "beto" for num in range(1, 10) if num != 5}}
+    assert taken(reader) == expected
+    assert reader.free == SIZE - len(expected)
+    assert reader.version == writer.version
+
+
+def test_reader_at_the_snapshot_version_follows_the_new_journal(tmp_path):
+    writer = journal(tmp_path)
+    reader = journal(tmp_path)
+    writer.claim([1], "ana")
+    assert taken(reader) == {1: "ana"}
+    writer.snapshot()
+    writer.claim([2], "beto")
+    assert taken(reader) == {1: "ana", 2: "beto"}
+    assert reader.changes_since(1) == (2, [(2, 2, True, "beto")])
+
+
+def test_startup_replays_the_journal_after_the_snapshot(tmp_path):
+    board = journal(tmp_path, snapshot_every=3)
+    for num in range(5):
+        board.claim([num], "ana")
+    # Snapshot en la versión 3 y las dos últimas en el journal
+    assert os.path.getsize(tmp_path / "journal.log") > 0
+    reopened = journal(tmp_path)
+    assert reopened.version == 5
+    assert taken(reopened) == {num: "ana" for num in range(5)}
+
+
+def test_crash_between_snapshot_and_rotation_does_not_reapply(tmp_path):
+    board = journal(tmp_path)
+    board.claim([1], "ana")
+    board.claim([2], "beto")
+    shutil.copy(tmp_path / "journal.log", tmp_path / "old.log")
+    board.snapshot()
+    # Como si se cortara antes de rotar: el journal viejo sigue junto al snapshot nuevo
+    os.replace(tmp_path / "old.log", tmp_path / "journal.log")
+    reopened = journal(tmp_path)
+    assert reopened.version == 2
+    assert reopened.free == SIZE - 2
+    assert taken(reopened) == {1: "ana", 2: "beto"}
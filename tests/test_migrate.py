@@ -0,0 +1,46 @@
+import json
+import os
+import sqlite3
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# app.py se configura al importarse, así que la base vieja se migra en otro proceso
+BOOTSTRAP = """
+import json, app
+app.bootstrap()
+client = app.app.test_client()
+resp = client.get("/api/participants?q=jose", headers={"X-Admin-Key": "test"})
+print(json.dumps(resp.get_json()))
+"""
+
+
+def test_bootstrap_migrates_a_baseline_database(tmp_path):
+    db = tmp_path / "state.db"
+    conn = sqlite3.connect(db)
+    conn.execute(
+        "CREATE TABLE number_picks (id INTEGER NOT NULL PRIMARY KEY, taken BOOLEAN NOT NULL, "
+        "name VARCHAR(80) NOT NULL, updated_at DATETIME NOT NULL)"
+    )
+    conn.executemany(
+        "INSERT INTO number_picks (id, taken, name, updated_at) VALUES (?, ?, ?, '2024-01-01 00:00:00')",
+        [(i, int(i == 7), "José Pérez" if i == 7 else "") for i in range(100)],
+    )
+    conn.commit()
+    conn.close()
+
+    env = {k: v for k, v in os.environ.items() if k not in ("DATABASE_READ_URL", "BOARD_STORE", "PROMETHEUS_MULTIPROC_DIR")}
+    env.update(DATABASE_URL=f"sqlite:///{db}", ADMIN_KEY="test", BOARD_SIZE="100", EXPORT_DIR=str(tmp_path / "exports"))
+    out = subprocess.run([sys.executable, "-c", BOOTSTRAP], cwd=ROOT, env=env, capture_output=True, text=True, check=True)
+    found = json.loads(out.stdout.strip().splitlines()[-1])
+
+    conn = sqlite3.connect(db)
+    pk = [row[1] for row in sorted(conn.execute("PRAGMA table_info(number_picks)"), key=lambda row: row[5]) if row[5]]
+    row = conn.execute("SELECT raffle_id, id, taken, name, name_key FROM number_picks WHERE taken").fetchall()
+    tables = {name for (name,) in conn.execute("SELECT name FROM sqlite_master WHERE type = 'table'")}
+    conn.close()
+    assert pk == ["raffle_id", "id"]
+    assert row == [(1, 7, 1, "José Pérez", "jose perez")]
+    assert "number_picks_old" not in tables
+    assert found["participants"] == [{"name": "José Pérez", "numbers": ["07"], "count": 1, "total": found["price"]}]
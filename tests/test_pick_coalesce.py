@@ -0,0 +1,50 @@
+import threading
+import time
+
+import app as rifa
+
+XHR = {"X-Requested-With": "XMLHttpRequest"}
+
+
+def pick(client, num, name):
+    return client.post(f"/pick/{num}", data={"name": name}, headers=XHR)
+
+
+def test_repeat_after_release_claims_again(client):
+    assert pick(client, "05", "Ana").status_code == 200
+    client.post("/release/05", data={"key": "test"})
+    assert pick(client, "05", "Ana").status_code == 200
+    state = {item["num"]: item["taken"] for item in client.get("/api/state").get_json()}
+    assert state["05"]
+
+
+def test_busy_is_not_replayed_after_release(client):
+    assert pick(client, "05", "Ana").status_code == 200
+    assert pick(client, "05", "Beto").status_code == 409
+    client.post("/release/05", data={"key": "test"})
+    assert pick(client, "05", "Beto").status_code == 200
+
+
+def test_identical_picks_in_flight_share_one_attempt():
+    coalescer = rifa.PickCoalescer()
+    started, release = threading.Event(), threading.Event()
+    calls, results = [], []
+
+    def attempt():
+        calls.append(1)
+        started.set()
+        release.wait(5)
+        return "ok"
+
+    owner = threading.Thread(target=lambda: results.append(coalescer.run("k", attempt)))
+    owner.start()
+    started.wait(5)
+    follower = threading.Thread(target=lambda: results.append(coalescer.run("k", attempt)))
+    follower.start()
+    time.sleep(0.2)             # que el segundo llegue mientras el primero sigue en curso
+    release.set()
+    owner.join(5)
+    follower.join(5)
+    assert len(calls) == 1
+    assert sorted(results) == [("ok", False), ("ok", True)]
+    assert coalescer.entries == {}
@@ -0,0 +1,52 @@
+import pytest
+
+import app as rifa
+
+
+def taken(client):
+    return {item["num"]: item["name"] for item in client.get("/api/state").get_json() if item["taken"]}
+
+
+def test_all_mode_is_all_or_nothing(client):
+    assert client.post("/pick", json={"nums": ["05"], "name": "Ana"}).status_code == 200
+    resp = client.post("/pick", json={"nums": ["04", "05", "06"], "name": "Beto"})
+    assert resp.status_code == 409
+    assert resp.get_json()["results"] == {"04": "no_reservado", "05": "ocupado", "06": "no_reservado"}
+    assert taken(client) == {"05": "Ana"}
+
+
+def test_partial_mode_claims_the_free_ones(client):
+    client.post("/pick", json={"nums": ["05"], "name": "Ana"})
+    resp = client.post("/pick", json={"nums": ["06", "05", "04"], "name": "Beto", "mode": "partial"})
+    body = resp.get_json()
+    assert resp.status_code == 200
+    assert body["results"] == {"04": "ok", "05": "ocupado", "06": "ok"}
+    assert body["free"] == 97
+    assert taken(client) == {"04": "Beto", "05": "Ana", "06": "Beto"}
+
+
+def test_form_body_with_comma_separated_numbers(client):
+    resp = client.post("/pick", data={"nums": "10, 11", "name": "Ana"})
+    assert resp.status_code == 200
+    assert taken(client) == {"10": "Ana", "11": "Ana"}
+
+
+@pytest.mark.parametrize("body, error", [
+    ({"nums": ["07", "xx"], "name": "Ana"}, "NUMEROS_INVALIDOS"),
+    ({"nums": ["07", "100"], "name": "Ana"}, "NUMEROS_INVALIDOS"),
+    ({"nums": ["07", 8], "name": "Ana"}, "NUMEROS_INVALIDOS"),
+    ({"nums": [], "name": "Ana"}, "NUMEROS_INVALIDOS"),
+    ({"nums": [f"{i:02d}" for i in range(rifa.PICK_BATCH_MAX + 1)], "name": "Ana"}, "NUMEROS_INVALIDOS"),
+    ({"nums": ["07"], "name": "  "}, "NOMBRE_REQUERIDO"),
+    ({"nums": ["07"]}, "NOMBRE_REQUERIDO"),
+    ({"nums": ["07"], "name": 5}, "FORMATO_INVALIDO"),
+    ({"nums": {"a": "07"}, "name": "Ana"}, "FORMATO_INVALIDO"),
+    ({"nums": 7, "name": "Ana"}, "FORMATO_INVALIDO"),
+    ({"nums": ["07"], "name": "Ana", "mode": "some"}, "FORMATO_INVALIDO"),
+    (["07"], "FORMATO_INVALIDO"),
+])
+def test_invalid_input_is_rejected(client, body, error):
+    resp = client.post("/pick", json=body)
+    assert resp.status_code == 400
+    assert resp.get_json()["error"] == error
+    assert taken(client) == {}
@@ -0,0 +1,20 @@
+import pytest
+
+import app as rifa
+
+
+@pytest.fixture
+def limited(monkeypatch):
+    monkeypatch.setitem(rifa.RATE_LIMITS, "state", (0.001, 2))
+    monkeypatch.setattr(rifa, "rate_limiter", rifa.RateLimiter(100))
+
+
+def test_forwarded_for_is_ignored_without_proxy(client, limited):
+    codes = [client.get("/api/state", headers={"X-Forwarded-For": f"10.0.0.{i}"}).status_code for i in range(3)]
+    assert codes == [200, 200, 429]
+
+
+def test_forwarded_for_is_used_behind_one_proxy(client, limited, monkeypatch):
+    monkeypatch.setattr(rifa, "PROXY_HOPS", 1)
+    codes = [client.get("/api/state", headers={"X-Forwarded-For": f"10.0.0.{i}"}).status_code for i in range(3)]
+    assert codes == [200, 200, 200]
@@ -0,0 +1,15 @@
+import app as rifa
+
+
+def test_streams_over_the_limit_get_503(client, monkeypatch):
+    monkeypatch.setattr(rifa, "STREAM_MAX_OPEN", 1)
+    first = client.get("/api/stream")
+    assert first.status_code == 200
+    second = client.get("/api/stream")
+    assert second.status_code == 503
+    assert second.headers["Retry-After"] == "60"
+    first.close()
+    third = client.get("/api/stream")
+    assert third.status_code == 200
+    third.close()
+    assert rifa.stream_slots["open"] == 0